@@ -1,68 +1,436 @@
 import requests
-from bs4 import BeautifulSoup
-from fake_useragent import UserAgent
-import re
 import logging
+import asyncio
+import time
+import aiohttp
+from collections import defaultdict, deque
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from fetcher import AsyncFetcher, RetryPolicy, get_fetcher
+from ratelimit import get_host_limiter
+from html_backends import make_soup
+from price import parse_price
+from streaming import CHUNK_SIZE, StreamingExtractor
+from extraction import PageCandidates
+from structured import product_from_shopify, shopify_product_url
+from site_profiles import get_profile
+from content_hash import content_key
+from user_agents import get_user_agents
+import metrics
+
+PARSE_WORKERS = 4
+_parse_executor = None
+
+def get_parse_executor():
+    global _parse_executor
+    if _parse_executor is None:
+        _parse_executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix='product-parser')
+    return _parse_executor
+
+_process_executor = None
+
+def get_process_executor(workers=None):
+    # BeautifulSoup holds the GIL, so on big boxes parsing goes to worker
+    # processes; only html goes in and a small result dict comes back
+    global _process_executor
+    if _process_executor is None:
+        _process_executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=warm_parse_worker,
+        )
+    return _process_executor
+
+def close_process_executor():
+    global _process_executor
+    if _process_executor is not None:
+        _process_executor.shutdown(cancel_futures=True)
+        _process_executor = None
+
+def warm_parse_worker():
+    # pay for imports, backend lookup and regex compilation once per worker
+    parse_html_result('http://localhost/', '<html><body><h1>warm</h1><span>$1</span></body></html>')
+
+def parse_html_result(url, html, backend=None):
+    parser = ProductParser(url, backend=backend)
+    parser.parse_page(html)
+    return parser.parse_result()
 
 logging.basicConfig(level=logging.INFO)
 
+# shops the parser is checked against, see test() and benchmarks/bench_corpus.py
+TEST_URLS = [
+    'https://faworldentertainment.com/collections/bottoms/products/salt-and-pepper-canvas-double-knee-pant',
+    'https://shop.palaceskateboards.com/products/a7oh8xvpjvqf',
+    'https://www.asos.com/asos-design/asos-design-fine-knit-boat-neck-top-in-cream/prd/205945056#colourWayId-205945063',
+    'https://www.grailed.com/listings/67108758-arc-teryx-x-streetwear-x-vintage-vintage-hat-arcteryx-cap-outdoor-gore-tex-arcteryx?g_aidx=Listing_by_heat_production&g_aqid=02fab20a807c337cc1a14ed9de6d2154',
+    'https://stockx.com/air-jordan-4-retro-white-thunder?size=4',
+    'https://www.farfetch.com/nl/shopping/men/palm-angels-hermosa-item-25038217.aspx',
+    'https://shop.doverstreetmarket.com/collections/comme-des-garcons-play/products/play-unisex-parka-1-carry-over-ax-t344-051-1',
+    'https://www.ebay.com/itm/126523570030?_nkw=fuckingawesome+t+shirt&itmmeta=01J7AT6Q804YB77VR8C1EGQTXX&hash=item1d7564776e:g:S~cAAOSwFUBmZ4b8&itmprp=enc%3AAQAJAAAA8HoV3kP08IDx%2BKZ9MfhVJKnQqNnglOE7vrjZDWo73ZBuvjZPZ6Ek9rmfm9giPGiBO9D2FlDJzpvQ3OL9UWVt4DEUrR73ycQsFsuc9CfidOpLNAQDn5eTkIDJ%2FEwl8EBbBYchgWkFArjF22Dw%2FybvPqVMMgzM1hyGIVfvQSK3HUeVZhlT9zoRO14iy%2BhRKbugMNTTsEcHyGisNoMgGZGvDEah%2FTWL2ks61ObEkfxjWdsEFSdgOQYni4MevdQx8rdg0XQHSCBsmKRH0acnX9N%2Fv4yjHiNXlQcXx39eSes%2BJaahO8ZrZ0pXJcvgM0D5824cAA%3D%3D%7Ctkp%3ABk9SR4r0mtq6ZA',
+    'https://www.carhartt-wip.com/en/men-featured-9/og-detroit-jacket-winter-malbec-black-aged-canvas-964_1',
+    'https://itkkit.com/catalog/product/246455_thisisneverthat-regular-jeans-red/',
+    'https://www.drmartens.com/eu/en_eu/sinclair-milled-nappa-leather-platform-boots-black/p/22564001',
+    'https://fuckthepopulation.com/collections/shop/products/made-in-hell-leather-puffer-coatwhite',
+    'https://dimemtl.com/collections/dime-fall-24/products/fa24-coverstitch-sherpa-fleece-military-brown',
+    'https://kith.com/collections/mens-footwear/products/aaih3432',
+    'https://shop-jp.doverstreetmarket.com/collections/asics/products/asics-ub8-s-gt-2160-400',
+]
+
 class ProductParser:
-    def __init__(self, url, timeout=15):
+    def __init__(self, url, timeout=15, document_cache=None, use_shopify_json=False, backend=None, streaming=False,
+                 http_cache=None, result_store=None, slow_pages=None, retry_policy=None):
         self.url = url
         self.timeout = timeout
-        self.ua = UserAgent()
-        self.headers = {'User-Agent': self.ua.random}
+        # fetcher.RetryPolicy for the page request; by default two jittered
+        # retries of timeouts, connection errors and 429/5xx, all within 2 * timeout
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(retries=2, deadline=2 * timeout)
+        # BeautifulSoup tree builder, None means html_backends.default_backend
+        self.backend = backend
+        # read the body in chunks and stop once json-ld gave name and price;
+        # 'dom' also stops on meta values or the first <h1> and price <span>,
+        # which is faster but may disagree with a json-ld block further down
+        self.streaming = streaming
+        self.bytes_downloaded = None
+        # optional cache.TTLCache shared between parsers, url -> parsed soup
+        self.document_cache = document_cache
+        # optional http_cache.HTTPCache: conditional requests, and on a 304
+        # the stored page and its stored parse result are reused
+        self.http_cache = http_cache
+        self.cached_result = None
+        # optional store (e.g. cache.TTLCache) of content hash -> parse result,
+        # a page whose html did not change is not parsed again
+        self.result_store = result_store
+        self.content_key = None
+        # optional slow_pages.SlowPageSampler, keeps html and a profile of
+        # pages whose fetch or parse went over its threshold
+        self.slow_pages = slow_pages
+        self.started = None
+        self.fetch_seconds = None
+        self.raw_html = None
+        # site_profiles.SiteProfile for known shops, tried before the heuristics
+        self.profile = get_profile(url)
+        self.profile_match = None
+        # ask Shopify's /products/<handle>.js before downloading the page
+        self.use_shopify_json = use_shopify_json or bool(self.profile and self.profile.use_shopify_json)
+        # process-wide pool, the same agent for every request to one shop
+        self.headers = get_user_agents().headers_for(url)
         self.soup = None
         self.product_name = None
         self.product_price = None
+        # price.Price with a Decimal amount and ISO currency behind product_price
+        self.price_value = None
+        # which tier answered: 'shopify', 'profile', 'json-ld', 'meta' or 'dom'
+        self.name_source = None
+        self.price_source = None
+        self.candidates = None
+
+    def fetch_page(self, reuse_result=False):
+        entry = self.http_cache.get(self.url) if self.http_cache is not None else None
+        try:
+            started = time.perf_counter()
+            with metrics.timer('parser_stage_seconds', stage='fetch'):
+                response = self.http_get(self.url, headers=self.request_headers(entry), timeout=self.timeout)
+            self.fetch_seconds = time.perf_counter() - started
+            if metrics.enabled():
+                metrics.inc('fetch_bytes_total', len(response.content))
+            html = self.cached_response(entry, response.status_code, response.text, response.headers, reuse_result)
+            if reuse_result:
+                html = self.lookup_result(html)
+            if html is not None:
+                self.load_html(html)
+        except requests.exceptions.HTTPError as http_err:
+            logging.error(f"HTTP error occurred: {http_err}")
+        except requests.exceptions.Timeout:
+            logging.error(f"Timeout after {self.timeout} seconds on {self.url}.")
+        except Exception as err:
+            logging.error(f"Other error occurred: {err}")
+
+    async def fetch_html_async(self, fetcher=None, reuse_result=False):
+        fetcher = fetcher or get_fetcher()
+        try:
+            started = time.perf_counter()
+            if self.http_cache is None:
+                html = await fetcher.fetch_text(self.url, headers=self.headers, timeout=self.timeout, policy=self.retry_policy)
+            else:
+                entry = self.http_cache.get(self.url)
+                status, text, headers = await self.retry_policy.call(
+                    lambda timeout: fetcher.fetch_conditional(self.url, headers=self.request_headers(entry), timeout=timeout),
+                    self.url, self.timeout)
+                html = self.cached_response(entry, status, text, headers, reuse_result)
+            self.fetch_seconds = time.perf_counter() - started
+            return self.lookup_result(html) if reuse_result else html
+        except aiohttp.ClientResponseError as http_err:
+            logging.error(f"HTTP error occurred: {http_err}")
+        except asyncio.TimeoutError:
+            logging.error(f"Timeout after {self.timeout} seconds on {self.url}.")
+        except Exception as err:
+            logging.error(f"Other error occurred: {err}")
+        return None
+
+    def http_get(self, url, timeout=None, **kwargs):
+        # blocking GET through the shared per-host limiter and circuit
+        # breaker, transient failures are retried as retry_policy says
+        return self.retry_policy.call_sync(lambda attempt_timeout: self.http_get_once(url, timeout=attempt_timeout, **kwargs),
+                                           url, timeout if timeout is not None else self.timeout)
 
-    def fetch_page(self):
+    def http_get_once(self, url, **kwargs):
+        limiter = get_host_limiter()
+        limiter.acquire_sync(url)
         try:
-            response = requests.get(self.url, headers=self.headers, timeout=self.timeout)
+            response = requests.get(url, **kwargs)
             response.raise_for_status()
-            self.soup = BeautifulSoup(response.text, 'html.parser')
+        except Exception as err:
+            limiter.record_error(url, err)
+            raise
+        limiter.record_response(url, response.status_code, response.headers)
+        return response
+
+    def request_headers(self, entry):
+        if entry is None:
+            return self.headers
+        return {**self.headers, **self.http_cache.conditional_headers(entry)}
+
+    def cached_response(self, entry, status, text, headers, reuse_result=False):
+        # html to parse; on a 304 that is the stored copy, or None when
+        # reuse_result is set and the stored parse result went to cached_result
+        if self.http_cache is None:
+            return text
+        metrics.inc('parser_cache_requests_total', cache='http', result='hit' if status == 304 else 'miss')
+        if status == 304:
+            if entry is not None:
+                if reuse_result and entry.get('result'):
+                    self.http_cache.touch(self.url)
+                    self.cached_result = entry['result']
+                    return None
+                body = self.http_cache.body(self.url)
+                if body is not None:
+                    self.http_cache.touch(self.url)
+                    return body
+            logging.error(f"Got 304 for {self.url} without a cached copy.")
+            return None
+        self.http_cache.store(self.url, text, headers.get('ETag'), headers.get('Last-Modified'))
+        return text
+
+    def lookup_result(self, html):
+        # html still to parse, or None when the same content was parsed before
+        if self.result_store is None or html is None:
+            return html
+        self.content_key = content_key(html, self.profile)
+        result = self.result_store.get(self.content_key)
+        metrics.inc('parser_cache_requests_total', cache='content', result='hit' if result is not None else 'miss')
+        if result is None:
+            return html
+        self.cached_result = result
+        return None
+
+    def store_parse_result(self):
+        if self.http_cache is not None:
+            self.http_cache.store_result(self.url, self.parse_result())
+        if self.result_store is not None and self.content_key is not None:
+            self.result_store.set(self.content_key, self.parse_result())
+
+    def fetch_page_streaming(self):
+        extractor = None
+        try:
+            with self.http_get(self.url, headers=self.headers, timeout=self.timeout, stream=True) as response:
+                extractor = StreamingExtractor(response.encoding, stop_on_dom=self.streaming == 'dom')
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if extractor.feed_bytes(chunk):
+                        break
         except requests.exceptions.HTTPError as http_err:
             logging.error(f"HTTP error occurred: {http_err}")
+            extractor = None
         except requests.exceptions.Timeout:
             logging.error(f"Timeout after {self.timeout} seconds on {self.url}.")
+            extractor = None
+        except Exception as err:
+            logging.error(f"Other error occurred: {err}")
+            extractor = None
+        return extractor
+
+    async def fetch_page_streaming_async(self, fetcher=None):
+        fetcher = fetcher or get_fetcher()
+        extractor = None
+
+        def consume(chunk, encoding):
+            nonlocal extractor
+            if extractor is None:
+                extractor = StreamingExtractor(encoding, stop_on_dom=self.streaming == 'dom')
+            return extractor.feed_bytes(chunk)
+
+        try:
+            await fetcher.fetch_stream(self.url, consume, headers=self.headers, timeout=self.timeout, chunk_size=CHUNK_SIZE)
+        except aiohttp.ClientResponseError as http_err:
+            logging.error(f"HTTP error occurred: {http_err}")
+            extractor = None
+        except asyncio.TimeoutError:
+            logging.error(f"Timeout after {self.timeout} seconds on {self.url}.")
+            extractor = None
         except Exception as err:
             logging.error(f"Other error occurred: {err}")
+            extractor = None
+        return extractor
+
+    def use_streaming(self):
+        # a site profile's selectors come first in full parsing, the stream cannot run them
+        return bool(self.streaming) and not (self.profile is not None and self.profile.has_lookups)
+
+    def apply_streaming_result(self, extractor):
+        # False means the stream did not answer both fields and the caller
+        # should parse extractor.text() with the full heuristics
+        self.bytes_downloaded = extractor.bytes_read
+        if not extractor.done:
+            return False
+        self.product_name, self.name_source = extractor.name, extractor.name_source
+        self.set_price(extractor.price, extractor.price_source)
+        return True
+
+    def fetch_shopify_product(self):
+        shopify_url = shopify_product_url(self.url)
+        if not shopify_url:
+            return False
+        try:
+            response = self.http_get(shopify_url, headers=self.headers, timeout=self.timeout)
+            return self.apply_shopify_product(response.json(), response.cookies.get('cart_currency'))
+        except Exception as err:
+            logging.info(f"No Shopify product JSON for {self.url}: {err}")
+            return False
+
+    async def fetch_shopify_product_async(self, fetcher=None):
+        shopify_url = shopify_product_url(self.url)
+        if not shopify_url:
+            return False
+        fetcher = fetcher or get_fetcher()
+        try:
+            data, cookies = await fetcher.fetch_json(shopify_url, headers=self.headers, timeout=self.timeout)
+            return self.apply_shopify_product(data, cookies.get('cart_currency'))
+        except Exception as err:
+            logging.info(f"No Shopify product JSON for {self.url}: {err}")
+            return False
+
+    def apply_shopify_product(self, data, currency=None):
+        name, price = product_from_shopify(data, currency)
+        # without the cart_currency cookie the amount has no currency, the
+        # page's meta or DOM price is better than a bare number
+        if not name or not price or price.currency is None:
+            return False
+        self.product_name, self.name_source = name, 'shopify'
+        self.set_price(price, 'shopify')
+        return True
 
+    async def fetch_page_async(self, fetcher=None):
+        html = await self.fetch_html_async(fetcher)
+        if html is not None:
+            self.load_html(html)
+
+    def load_html(self, html):
+        with metrics.timer('parser_stage_seconds', stage='parse'):
+            self.soup = make_soup(html, self.backend)
+        if self.slow_pages is not None:
+            self.raw_html = html
+        if self.document_cache is not None:
+            self.document_cache.set(self.url, self.soup)
+
+    def has_page(self):
+        if self.soup is None and self.document_cache is not None:
+            self.soup = self.document_cache.get(self.url)
+            metrics.inc('parser_cache_requests_total', cache='document', result='hit' if self.soup is not None else 'miss')
+        return self.soup is not None
+
+    def ensure_page(self):
+        if not self.has_page():
+            self.fetch_page()
+
+    def invalidate(self):
+        self.soup = None
+        self.product_name = None
+        self.product_price = None
+        self.cached_result = None
+        if self.document_cache is not None:
+            self.document_cache.pop(self.url)
+
+    def parse_page(self, html=None):
+        if html is not None:
+            self.load_html(html)
+        self.parse_product_name()
+        self.parse_product_price()
+
+    def parse_result(self):
+        return {
+            'name': self.product_name,
+            'name_source': self.name_source,
+            'price': self.product_price,
+            'price_value': self.price_value,
+            'price_source': self.price_source,
+        }
+
+    def apply_parse_result(self, result):
+        self.product_name, self.name_source = result['name'], result['name_source']
+        self.product_price, self.price_source = result['price'], result['price_source']
+        self.price_value = result['price_value']
+
+    def get_candidates(self):
+        # one tree walk per soup, callers may swap self.soup directly
+        if self.candidates is None or self.candidates[0] is not self.soup:
+            self.candidates = (self.soup, PageCandidates(self.soup))
+        return self.candidates[1]
+
+    def get_profile_match(self):
+        # (name, price) from the site profile, None when there is no profile
+        if self.profile is None or not self.profile.has_lookups:
+            return None
+        if self.profile_match is None or self.profile_match[0] is not self.soup:
+            self.profile_match = (self.soup, self.profile.extract(self.soup))
+        return self.profile_match[1]
+
+    @metrics.timed('parser_stage_seconds', stage='extract_name')
     def parse_product_name(self):
         if self.soup:
-            search_tags = ['h1', 'h2', 'h3', 'title', 'div', 'span']
-            search_classes = ['product-title', 'product-name', 'name', 'title']
-            
-            for tag in search_tags:
-                product_name_tag = self.soup.find(tag)
-                if product_name_tag:
-                    self.product_name = product_name_tag.get_text(strip=True)
-                    return
-            
-            for cls in search_classes:
-                product_name_tag = self.soup.find(class_=cls)
-                if product_name_tag:
-                    self.product_name = product_name_tag.get_text(strip=True)
-                    return
+            profile_match = self.get_profile_match()
+            if profile_match and profile_match[0]:
+                self.product_name, self.name_source = profile_match[0], 'profile'
+                return
+
+            candidates = self.get_candidates()
+            structured_name = candidates.structured.get('name')
+            if structured_name:
+                self.product_name, self.name_source = structured_name
+                return
+
+            product_name_tag = candidates.name_tag()
+            if product_name_tag:
+                self.product_name = product_name_tag.get_text(strip=True)
+                self.name_source = 'dom'
+                return
 
             self.product_name = "Name not found"
             logging.warning("Cannot find product name.")
         else:
             logging.error("No content to parse for product name.")
 
+    @metrics.timed('parser_stage_seconds', stage='extract_price')
     def parse_product_price(self):
         if self.soup:
-            currency_symbols = r'[£$€¥₹]'
-            product_price_tag = self.soup.find('span', string=lambda text: re.search(currency_symbols, text) if text else False)
+            profile_match = self.get_profile_match()
+            if profile_match and profile_match[1]:
+                self.set_price(profile_match[1], 'profile')
+                return
+
+            candidates = self.get_candidates()
+            structured_price = candidates.structured.get('price')
+            if structured_price:
+                self.set_price(*structured_price)
+                return
+
+            product_price_tag = candidates.price_tag
             
             if product_price_tag:
-                price_text = product_price_tag.get_text(strip=True)
-                price_text = re.sub(r'[^\d\.,£$€¥₹]', '', price_text)
-                price_text = re.sub(r'\s+', '', price_text)
-
-                numeric_price = re.search(rf'({currency_symbols}\d{{1,3}}(,\d{{3}})*(\.\d+)?|\d{{1,3}}(,\d{{3}})*(\.\d+)?\s*{currency_symbols})', price_text)
+                numeric_price = parse_price(product_price_tag.get_text(strip=True))
                 if numeric_price:
-                    self.product_price = numeric_price.group(0).strip()
+                    self.set_price(numeric_price, 'dom')
                 else:
                     self.product_price = "Price not found"
                     logging.warning("Cannot extract price.")
@@ -74,52 +442,190 @@ class ProductParser:
             logging.error("No content to parse for product price.")
 
 
-    def get_product_info(self):
-        self.fetch_page()
-        self.parse_product_name()
-        self.parse_product_price()
+    def set_price(self, price, source):
+        self.price_value = price
+        self.product_price = price.text
+        self.price_source = source
+
+    def product_info(self):
+        if self.slow_pages is not None and self.started is not None:
+            # everything after the download counts as parsing
+            parse_seconds = time.perf_counter() - self.started - (self.fetch_seconds or 0)
+            self.slow_pages.check(self.url, self.raw_html, self.fetch_seconds, parse_seconds, parse_html_result, self.backend)
+            self.started = None
+        metrics.inc('parser_extract_source_total', field='name', source=self.name_source or 'none')
+        metrics.inc('parser_extract_source_total', field='price', source=self.price_source or 'none')
         return {
             'name': self.product_name,
             'price': self.product_price
         }
+
+    def get_product_info(self):
+        self.started = time.perf_counter()
+        if self.use_shopify_json and not self.has_page() and self.fetch_shopify_product():
+            return self.product_info()
+        if self.use_streaming() and not self.has_page():
+            extractor = self.fetch_page_streaming()
+            if extractor is not None:
+                if self.apply_streaming_result(extractor):
+                    return self.product_info()
+                self.load_html(extractor.text())
+        fetched = not self.has_page()
+        if fetched:
+            self.fetch_page(reuse_result=True)
+        if self.cached_result is not None:
+            self.apply_parse_result(self.cached_result)
+            return self.product_info()
+        self.parse_product_name()
+        self.parse_product_price()
+        if fetched and self.soup is not None:
+            self.store_parse_result()
+        return self.product_info()
+
+    async def get_product_info_async(self, fetcher=None, executor=None):
+        self.started = time.perf_counter()
+        html = None
+        if not self.has_page():
+            if self.use_shopify_json and await self.fetch_shopify_product_async(fetcher):
+                return self.product_info()
+            if self.use_streaming():
+                extractor = await self.fetch_page_streaming_async(fetcher)
+                if extractor is not None:
+                    if self.apply_streaming_result(extractor):
+                        return self.product_info()
+                    html = extractor.text()
+            else:
+                html = await self.fetch_html_async(fetcher, reuse_result=True)
+                if self.cached_result is not None:
+                    self.apply_parse_result(self.cached_result)
+                    return self.product_info()
+        if html is None and self.soup is None:
+            self.parse_page()
+        elif html is not None and isinstance(executor, ProcessPoolExecutor):
+            # the soup stays in the worker, so document_cache is not filled
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(executor, parse_html_result, self.url, html, self.backend)
+            if self.slow_pages is not None:
+                self.raw_html = html
+            self.apply_parse_result(result)
+        else:
+            # BeautifulSoup work is CPU-bound, keep it off the event loop
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(executor or get_parse_executor(), self.parse_page, html)
+        if html is not None and not self.use_streaming():
+            self.store_parse_result()
+        return self.product_info()
         
+    @classmethod
+    def parse_many(cls, urls, concurrency=16, per_host=4, deadline=None, **options):
+        # blocking wrapper around parse_many_async for scripts: drives the
+        # batch on a private loop and session, yielding as pages finish; the
+        # rate limits and circuit breakers are the ones the bot uses
+        loop = asyncio.new_event_loop()
+        fetcher = AsyncFetcher(limit=concurrency, limit_per_host=per_host, rate_limiter=get_host_limiter())
+        results = cls.parse_many_async(urls, concurrency, per_host, deadline, fetcher=fetcher, **options)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(results.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(results.aclose())
+            loop.run_until_complete(fetcher.close())
+            loop.close()
+
+    @classmethod
+    async def parse_many_async(cls, urls, concurrency=16, per_host=4, deadline=None, fetcher=None, executor=None, **options):
+        # yields (url, info) in completion order; info is None when the page
+        # failed, was still running at the deadline (seconds for the whole
+        # batch) or was not started by then. urls may be a lazy iterable, it
+        # is read as slots free up; after the deadline the rest of it is read
+        # and yielded as (url, None). options go to ProductParser(url, **options).
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + deadline if deadline is not None else None
+        urls = iter(urls)
+        pending = {}
+        # a url starts only while its shop runs fewer than per_host pages;
+        # urls of busy shops are set aside in held (per host) and the
+        # iterable is read on while slots are free, so those slots go to
+        # other shops instead of queueing on one host
+        active = defaultdict(int)
+        held = defaultdict(deque)
+
+        def start(url):
+            active[urlsplit(url).hostname] += 1
+            pending[asyncio.ensure_future(cls(url, **options).get_product_info_async(fetcher, executor))] = url
+
+        def fill():
+            for host, waiting in list(held.items()):
+                while waiting and active[host] < per_host and len(pending) < concurrency:
+                    start(waiting.popleft())
+                if not waiting:
+                    del held[host]
+            while len(pending) < concurrency:
+                url = next(urls, None)
+                if url is None:
+                    return
+                host = urlsplit(url).hostname
+                if active[host] < per_host:
+                    start(url)
+                else:
+                    held[host].append(url)
+
+        try:
+            fill()
+            while pending:
+                timeout = None if deadline_at is None else max(0, deadline_at - loop.time())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logging.warning(f"Deadline of {deadline}s reached, {len(pending)} pages cancelled.")
+                    for task in pending:
+                        task.cancel()
+                    for url in list(pending.values()):
+                        yield url, None
+                    for waiting in held.values():
+                        for url in waiting:
+                            yield url, None
+                    for url in urls:
+                        yield url, None
+                    break
+                for task in done:
+                    url = pending.pop(task)
+                    active[urlsplit(url).hostname] -= 1
+                    try:
+                        product_info = task.result()
+                    except Exception as err:
+                        logging.error(f"Failed to parse {url}: {err}")
+                        product_info = None
+                    yield url, product_info
+                fill()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
     def get_product_name(self):
-        self.fetch_page()
+        self.ensure_page()
         self.parse_product_name()
         return self.product_name
 
     def get_product_price(self):
-        self.fetch_page()
+        self.ensure_page()
         self.parse_product_price()
         return self.product_price
 
     @staticmethod
     def test():
-        urls = [
-            'https://faworldentertainment.com/collections/bottoms/products/salt-and-pepper-canvas-double-knee-pant',
-            'https://shop.palaceskateboards.com/products/a7oh8xvpjvqf',
-            'https://www.asos.com/asos-design/asos-design-fine-knit-boat-neck-top-in-cream/prd/205945056#colourWayId-205945063',
-            'https://www.grailed.com/listings/67108758-arc-teryx-x-streetwear-x-vintage-vintage-hat-arcteryx-cap-outdoor-gore-tex-arcteryx?g_aidx=Listing_by_heat_production&g_aqid=02fab20a807c337cc1a14ed9de6d2154',
-            'https://stockx.com/air-jordan-4-retro-white-thunder?size=4',
-            'https://www.farfetch.com/nl/shopping/men/palm-angels-hermosa-item-25038217.aspx',
-            'https://shop.doverstreetmarket.com/collections/comme-des-garcons-play/products/play-unisex-parka-1-carry-over-ax-t344-051-1',
-            'https://www.ebay.com/itm/126523570030?_nkw=fuckingawesome+t+shirt&itmmeta=01J7AT6Q804YB77VR8C1EGQTXX&hash=item1d7564776e:g:S~cAAOSwFUBmZ4b8&itmprp=enc%3AAQAJAAAA8HoV3kP08IDx%2BKZ9MfhVJKnQqNnglOE7vrjZDWo73ZBuvjZPZ6Ek9rmfm9giPGiBO9D2FlDJzpvQ3OL9UWVt4DEUrR73ycQsFsuc9CfidOpLNAQDn5eTkIDJ%2FEwl8EBbBYchgWkFArjF22Dw%2FybvPqVMMgzM1hyGIVfvQSK3HUeVZhlT9zoRO14iy%2BhRKbugMNTTsEcHyGisNoMgGZGvDEah%2FTWL2ks61ObEkfxjWdsEFSdgOQYni4MevdQx8rdg0XQHSCBsmKRH0acnX9N%2Fv4yjHiNXlQcXx39eSes%2BJaahO8ZrZ0pXJcvgM0D5824cAA%3D%3D%7Ctkp%3ABk9SR4r0mtq6ZA',
-            'https://www.carhartt-wip.com/en/men-featured-9/og-detroit-jacket-winter-malbec-black-aged-canvas-964_1',
-            'https://itkkit.com/catalog/product/246455_thisisneverthat-regular-jeans-red/',
-            'https://www.drmartens.com/eu/en_eu/sinclair-milled-nappa-leather-platform-boots-black/p/22564001',
-            'https://fuckthepopulation.com/collections/shop/products/made-in-hell-leather-puffer-coatwhite',
-            'https://dimemtl.com/collections/dime-fall-24/products/fa24-coverstitch-sherpa-fleece-military-brown',
-            'https://kith.com/collections/mens-footwear/products/aaih3432',
-            'https://shop-jp.doverstreetmarket.com/collections/asics/products/asics-ub8-s-gt-2160-400'
-        ]
-        
-        for url in urls:
+        for url in TEST_URLS:
             parser = ProductParser(url)
             product_info = parser.get_product_info()
             
             logging.info(f"URL: {url}")
             logging.info(f"Name: {product_info['name']}")
             logging.info(f"Price: {product_info['price']}")
+            logging.info(f"Source: name={parser.name_source}, price={parser.price_source}")
             logging.info('-' * 40)
 
 if __name__ == "__main__":
@@ -1,9 +1,56 @@
 import pytest
 from bs4 import BeautifulSoup
 import requests
-from unittest.mock import Mock, patch
-
-from ProductParser import ProductParser
+import asyncio
+import json
+import multiprocessing
+import os
+import pstats
+import random
+import time
+import aiohttp
+from collections import defaultdict
+from aiohttp import web
+from unittest.mock import AsyncMock, Mock, patch
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+os.environ.setdefault('COMMISSION_RATE', '0.10')
+os.environ.setdefault('ADDITIONAL_FEE', '50')
+
+from ProductParser import ProductParser, parse_html_result, warm_parse_worker
+from fetcher import AsyncFetcher, HostLatency, RetryPolicy, close_fetcher, is_transient_error
+from cache import TTLCache, canonicalize_url
+from crawler import CrawlCheckpoint, PageCrawler
+from ratelimit import CircuitOpenError, HostRateLimiter, TokenBucket, retry_after_seconds
+from ndjson_sink import NDJSONWriter, read_ndjson
+from json_extract import iter_json_objects
+from structured import shopify_product_url
+from decimal import Decimal
+from price import Price, make_price, parse_price
+import html_backends
+import site_profiles
+import user_agents
+import metrics
+from slow_pages import SlowPageSampler, load_samples
+from http_cache import HTTPCache
+from content_hash import content_key
+import ProductParser as ProductParser_module
+import fetcher as fetcher_module
+import ratelimit as ratelimit_module
+from user_agents import UserAgentPool
+from streaming import StreamingExtractor
+from benchmarks.bench_extraction import legacy_extract, single_pass_extract
+from benchmarks.bench_parser_backends import extract, load_unittest_corpus
+from benchmarks.bench_corpus import measure as bench_corpus_measure, synthetic_corpus
+from bot import BotHandler
+import main_poizion
+
+@pytest.fixture(autouse=True)
+def fresh_host_limiter(mocker):
+    # rate and circuit breaker state is process-wide, a test must not see
+    # the failures an earlier one recorded for the same host
+    mocker.patch.object(ratelimit_module, '_default_limiter', None)
+    mocker.patch.object(fetcher_module, '_default_fetcher', None)
 
 def test_fetch_page_failure(mocker):
     mocker.patch('requests.get', side_effect=Exception("Network Error"))
@@ -828,4 +875,1274 @@ def test_parse_product_price_with_nested_tags(mocker):
 
     parser.parse_product_price()
 
-    assert parser.product_price == "$19.99"
\ No newline at end of file
+    assert parser.product_price == "$19.99"
+
+##
+
+PRODUCT_HTML = "<html><head><title>Test</title></head><body><h1>Test Product</h1><span>$19.99</span></body></html>"
+
+async def start_local_server(handler):
+    app = web.Application()
+    app.router.add_get('/{tail:.*}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}'
+
+def test_get_product_info_async():
+    async def handler(request):
+        return web.Response(text=PRODUCT_HTML, content_type='text/html')
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        fetcher = AsyncFetcher()
+        try:
+            return await ProductParser(f'{base_url}/product').get_product_info_async(fetcher)
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+    product_info = asyncio.run(scenario())
+
+    assert product_info['name'] == "Test Product"
+    assert product_info['price'] == "$19.99"
+
+def test_async_fetcher_reuses_connection():
+    peers = []
+
+    async def handler(request):
+        peers.append(request.transport.get_extra_info('peername'))
+        return web.Response(text=PRODUCT_HTML, content_type='text/html')
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        fetcher = AsyncFetcher()
+        try:
+            for i in range(3):
+                await ProductParser(f'{base_url}/product/{i}').get_product_info_async(fetcher)
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+    assert len(peers) == 3
+    assert len(set(peers)) == 1
+
+def test_fetch_page_async_http_error():
+    async def handler(request):
+        return web.Response(status=404)
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        fetcher = AsyncFetcher()
+        parser = ProductParser(f'{base_url}/missing')
+        try:
+            await parser.fetch_page_async(fetcher)
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+        return parser
+
+    parser = asyncio.run(scenario())
+
+    assert parser.soup is None
+
+
+def make_update(user_id, text):
+    update = Mock()
+    update.message.text = text
+    update.message.from_user.id = user_id
+    update.message.reply_text = AsyncMock()
+    return update
+
+def test_handle_message_concurrent_users_load():
+    users = 8
+    delay = 0.3
+
+    async def handler(request):
+        await asyncio.sleep(delay)
+        return web.Response(text=PRODUCT_HTML, content_type='text/html')
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        bot = BotHandler('123456:TEST-TOKEN')
+        updates = [make_update(user_id, f'{base_url}/product/{user_id}') for user_id in range(users)]
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(bot.handle_message(update, None) for update in updates))
+            elapsed = time.perf_counter() - started
+        finally:
+            await close_fetcher()
+            await runner.cleanup()
+        return updates, elapsed
+
+    updates, elapsed = asyncio.run(scenario())
+
+    for update in updates:
+        update.message.reply_text.assert_awaited_once_with("Product Name: Test Product\nProduct Price: $19.99")
+    assert elapsed < users * delay / 2
+
+
+def mock_product_response(mocker, html=PRODUCT_HTML):
+    mock_response = mocker.Mock()
+    mock_response.status_code = 200
+    mock_response.text = html
+    return mocker.patch('requests.get', return_value=mock_response)
+
+def test_get_product_name_and_price_fetch_once(mocker):
+    get = mock_product_response(mocker)
+
+    parser = ProductParser('http://example.com')
+
+    assert parser.get_product_name() == "Test Product"
+    assert parser.get_product_price() == "$19.99"
+    assert parser.get_product_info() == {'name': "Test Product", 'price': "$19.99"}
+    assert get.call_count == 1
+
+def test_invalidate_forces_refetch(mocker):
+    get = mock_product_response(mocker)
+
+    parser = ProductParser('http://example.com')
+    parser.get_product_info()
+    parser.invalidate()
+    parser.get_product_info()
+
+    assert get.call_count == 2
+
+def test_document_cache_shared_between_parsers(mocker):
+    get = mock_product_response(mocker)
+    cache = TTLCache(maxsize=8)
+
+    first = ProductParser('http://example.com', document_cache=cache).get_product_info()
+    second = ProductParser('http://example.com', document_cache=cache).get_product_info()
+
+    assert first == second == {'name': "Test Product", 'price': "$19.99"}
+    assert get.call_count == 1
+
+    ProductParser('http://example.com', document_cache=cache).invalidate()
+    ProductParser('http://example.com', document_cache=cache).get_product_info()
+
+    assert get.call_count == 2
+
+def test_ttl_cache_expires_and_evicts():
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, timer=lambda: now[0])
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+
+    now[0] = 11
+
+    assert cache.get('a') is None
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'size': 1}
+
+
+def test_canonicalize_url():
+    assert canonicalize_url('HTTPS://Kith.com:443/products/aaih3432/?utm_source=tg&size=9#reviews') == 'https://kith.com/products/aaih3432?size=9'
+    assert canonicalize_url('https://stockx.com/air-jordan-4?size=4&b=1') == canonicalize_url('https://stockx.com/air-jordan-4?b=1&size=4')
+
+def test_bot_result_cache_hit(mocker):
+    get = mock_product_response(mocker)
+    bot = BotHandler('123456:TEST-TOKEN', cache_ttl=60, cache_size=16)
+
+    first = bot.get_product_info('https://shop.example.com/products/aaih3432?utm_source=tg')
+    second = bot.get_product_info('https://shop.example.com/products/aaih3432/')
+
+    assert first == second == {'name': "Test Product", 'price': "$19.99"}
+    assert get.call_count == 1
+    assert bot.result_cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+def test_bot_result_cache_skips_missing_price(mocker):
+    get = mock_product_response(mocker, "<html><body><h1>Test Product</h1></body></html>")
+    bot = BotHandler('123456:TEST-TOKEN')
+
+    bot.get_product_info('https://shop.example.com/products/aaih3432')
+    bot.get_product_info('https://shop.example.com/products/aaih3432')
+
+    assert get.call_count == 2
+
+
+def test_bot_coalesces_identical_inflight_urls():
+    hits = []
+
+    async def handler(request):
+        hits.append(request.path)
+        await asyncio.sleep(0.2)
+        return web.Response(text=PRODUCT_HTML, content_type='text/html')
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        bot = BotHandler('123456:TEST-TOKEN')
+        urls = [f'{base_url}/products/drop?utm_source=user{i}' for i in range(10)]
+        try:
+            results = await asyncio.gather(*(bot.get_product_info_async(url) for url in urls))
+        finally:
+            await close_fetcher()
+            await runner.cleanup()
+        return bot, results
+
+    bot, results = asyncio.run(scenario())
+
+    assert hits == ['/products/drop']
+    assert all(result == {'name': "Test Product", 'price': "$19.99"} for result in results)
+    assert bot.inflight.shared == 9
+    assert len(bot.inflight) == 0
+
+
+def catalog_handler(last_page, hits, flaky_pages=()):
+    async def handler(request):
+        page_num = int(request.match_info['tail'].strip('/').split('/')[-1])
+        hits.append(page_num)
+        if page_num > last_page:
+            return web.Response(status=404)
+        if page_num in flaky_pages and hits.count(page_num) == 1:
+            return web.Response(status=503)
+        return web.Response(text=f'<a href="/page/2/">2</a><a href="/page/5/">5</a><script>{{"id": {page_num}}}</script>',
+                            content_type='text/html')
+    return handler
+
+def run_crawl(last_page, hits, pages=None, flaky_pages=()):
+    async def scenario():
+        runner, base_url = await start_local_server(catalog_handler(last_page, hits, flaky_pages))
+        crawler = PageCrawler(f'{base_url}/page/{{page}}/', concurrency=4, rate=1000, retries=2, backoff=0.01)
+        try:
+            discovered = await crawler.discover_last_page() if pages is None else None
+            results = [item async for item in crawler.crawl(lambda html: [html.count('id')], pages)]
+        finally:
+            await crawler.close()
+            await runner.cleanup()
+        return crawler, discovered, results
+
+    return asyncio.run(scenario())
+
+def test_crawler_discovers_last_page():
+    hits = []
+    crawler, discovered, results = run_crawl(23, hits)
+
+    assert discovered == 23
+    assert sorted(page_num for page_num, items in results) == list(range(1, 24))
+
+def test_crawler_retries_transient_errors():
+    hits = []
+    crawler, discovered, results = run_crawl(10, hits, pages=range(1, 11), flaky_pages={3, 7})
+
+    assert sorted(page_num for page_num, items in results) == list(range(1, 11))
+    assert hits.count(3) == 2 and hits.count(7) == 2
+    assert crawler.failed_pages == []
+
+def test_crawler_reports_failed_pages():
+    hits = []
+    crawler, discovered, results = run_crawl(5, hits, pages=range(1, 8))
+
+    assert sorted(page_num for page_num, items in results) == [1, 2, 3, 4, 5]
+    assert sorted(crawler.failed_pages) == [6, 7]
+
+def test_crawler_waits_out_open_circuit():
+    hits = []
+
+    async def handler(request):
+        hits.append(request.path)
+        if len(hits) <= 6:
+            return web.Response(status=503)
+        return web.Response(text='<script>{"id": 1}</script>', content_type='text/html')
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        limiter = HostRateLimiter(rate=1000, burst=1000, failure_threshold=3, reset_timeout=0.2)
+        crawler = PageCrawler(f'{base_url}/page/{{page}}/', fetcher=AsyncFetcher(rate_limiter=limiter),
+                              concurrency=4, retries=2, backoff=0.01)
+        try:
+            results = [item async for item in crawler.crawl(lambda html: [html.count('id')], range(1, 41))]
+        finally:
+            await crawler.close()
+            await runner.cleanup()
+        return crawler, results
+
+    crawler, results = asyncio.run(scenario())
+
+    assert sorted(page_num for page_num, items in results) == list(range(1, 41))
+    assert crawler.failed_pages == []
+
+def test_token_bucket_reserve():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, burst=2, timer=lambda: now[0])
+
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0.5, 1.0]
+
+    now[0] = 2.0
+
+    assert bucket.reserve() == 0
+
+
+def test_ndjson_writer_round_trip(tmp_path):
+    path = tmp_path / 'products.ndjson'
+    products = [{'id': i, 'name': f'Товар {i}', 'sizes': [40, 41]} for i in range(250)]
+
+    with NDJSONWriter(path, flush_every=100) as writer:
+        writer.write_many(products)
+
+    assert writer.count == 250
+    assert writer.offset == path.stat().st_size
+    assert list(read_ndjson(path)) == products
+
+def test_ndjson_writer_flushes_periodically(tmp_path):
+    path = tmp_path / 'products.ndjson'
+    writer = NDJSONWriter(path, flush_every=2)
+    writer.write({'id': 1})
+    writer.write({'id': 2})
+    writer.write({'id': 3})
+
+    assert [item['id'] for item in read_ndjson(path)] == [1, 2]
+
+    writer.close()
+
+    assert [item['id'] for item in read_ndjson(path)] == [1, 2, 3]
+
+
+def test_crawl_checkpoint_round_trip(tmp_path):
+    path = tmp_path / 'checkpoint.json'
+    checkpoint = CrawlCheckpoint(path, last_page=5)
+    checkpoint.mark_done(2, 100)
+    checkpoint.mark_done(1, 250)
+
+    loaded = CrawlCheckpoint.load(path)
+
+    assert loaded.completed_pages == {1, 2}
+    assert loaded.output_offset == 250
+    assert loaded.pending(range(1, loaded.last_page + 1)) == [3, 4, 5]
+
+def poizion_handler(hits, broken, status):
+    async def handler(request):
+        page_num = int(request.match_info['tail'].strip('/').split('/')[-1])
+        hits.append(page_num)
+        if page_num in broken:
+            return web.Response(status=status)
+        return web.Response(text=f'<script>{{"id": {page_num}}}</script>', content_type='text/html')
+    return handler
+
+def run_poizion(monkeypatch, argv, hits=None, broken=(), status=500):
+    async def scenario():
+        runner, base_url = await start_local_server(poizion_handler(hits if hits is not None else [], broken, status))
+        monkeypatch.setattr(main_poizion, 'page_url', f'{base_url}/page/{{page}}/')
+        try:
+            await main_poizion.main(main_poizion.parse_args(argv))
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+@pytest.fixture
+def poizion_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(main_poizion, 'output_path', str(tmp_path / 'products.ndjson'))
+    monkeypatch.setattr(main_poizion, 'checkpoint_path', str(tmp_path / 'checkpoint.json'))
+    return tmp_path
+
+def test_main_poizion_resume(poizion_paths, monkeypatch):
+    run_poizion(monkeypatch, ['--last-page', '6', '--retries', '0'], broken={4})
+
+    assert CrawlCheckpoint.load(main_poizion.checkpoint_path).completed_pages == {1, 2, 3, 5, 6}
+
+    hits = []
+    run_poizion(monkeypatch, ['--resume', '--retries', '0'], hits)
+
+    assert hits == [4]
+    assert sorted(item['id'] for item in read_ndjson(main_poizion.output_path)) == [1, 2, 3, 4, 5, 6]
+
+def test_main_poizion_fresh_run_resets_checkpoint(poizion_paths, monkeypatch):
+    CrawlCheckpoint(main_poizion.checkpoint_path, completed_pages=[1, 2, 3], output_offset=500, last_page=3).save()
+
+    run_poizion(monkeypatch, ['--last-page', '3', '--retries', '0'], broken={1, 2, 3}, status=404)
+
+    assert CrawlCheckpoint.load(main_poizion.checkpoint_path).completed_pages == set()
+
+    run_poizion(monkeypatch, ['--resume', '--retries', '0'])
+
+    assert sorted(item['id'] for item in read_ndjson(main_poizion.output_path)) == [1, 2, 3]
+
+def test_main_poizion_resume_with_short_output(poizion_paths, monkeypatch):
+    CrawlCheckpoint(main_poizion.checkpoint_path, completed_pages=[1, 2], output_offset=500, last_page=3).save()
+    (poizion_paths / 'products.ndjson').write_text('{"id": 1}\n', encoding='utf-8')
+
+    run_poizion(monkeypatch, ['--resume', '--retries', '0'])
+
+    assert sorted(item['id'] for item in read_ndjson(main_poizion.output_path)) == [1, 2, 3]
+
+def test_iter_json_objects_nested():
+    html = '<style>.a { color: red; }</style><script>var x = {"id": 1, "price": {"amount": 10}}; f({"id": 2});</script>'
+
+    assert list(iter_json_objects(html)) == [{'id': 1, 'price': {'amount': 10}}, {'id': 2}]
+
+def test_iter_json_objects_skips_broken_blocks():
+    html = ('<script>var cfg = {"a": undefined, "inner": {"id": 3}, "s": "}"}; var s = "{\\"id\\": 4}";'
+            ' f({"id": 5});</script>')
+
+    assert list(iter_json_objects(html)) == [{'id': 5}]
+
+def test_iter_json_objects_with_start_marker():
+    html = '{"products": [{"availableForSale": true, "id": 1}, {"availableForSale": false, "id": 2}]}'
+
+    assert [item['id'] for item in iter_json_objects(html, start='{"availableForSale"')] == [1, 2]
+
+
+def test_parse_product_from_json_ld():
+    html = """<html><head><script type="application/ld+json">
+    {"@context": "https://schema.org", "@graph": [{"@type": "BreadcrumbList"},
+     {"@type": "Product", "name": "Coverstitch Sherpa", "offers": [{"@type": "Offer", "price": "180.00", "priceCurrency": "CAD"}]}]}
+    </script></head><body><h1>Dime</h1><span>$1.00</span></body></html>"""
+    parser = ProductParser('http://example.com')
+    parser.soup = BeautifulSoup(html, 'html.parser')
+    parser.parse_product_name()
+    parser.parse_product_price()
+
+    assert parser.product_name == "Coverstitch Sherpa"
+    assert parser.product_price == "CAD 180.00"
+    assert parser.name_source == parser.price_source == 'json-ld'
+
+@pytest.mark.parametrize('name, currency', [
+    ([{"@language": "en", "@value": "Tee"}], [{"@value": "USD"}]),
+    ({"@value": "Tee"}, "USD"),
+    (["", "Tee"], "USD"),
+])
+def test_parse_product_from_json_ld_value_objects(name, currency):
+    json_ld = json.dumps({"@type": "Product", "name": name, "offers": {"price": "25.00", "priceCurrency": currency}})
+    parser = ProductParser('http://example.com')
+    parser.parse_page(f'<script type="application/ld+json">{json_ld}</script><h1>Dime</h1>')
+
+    assert (parser.product_name, parser.product_price) == ("Tee", "$25.00")
+
+def test_parse_product_from_json_ld_odd_shapes():
+    json_ld = json.dumps({"@type": "Product", "name": 42, "offers": {"price": True, "priceCurrency": {"code": "USD"}}})
+    parser = ProductParser('http://example.com')
+    parser.parse_page(f'<script type="application/ld+json">{json_ld}</script><h1>Dime</h1><span>$5</span>')
+
+    assert (parser.product_name, parser.product_price) == ("Dime", "$5")
+
+def test_make_price_rejects_non_prices():
+    assert make_price(True, 'USD') is None
+    assert make_price({'value': 1}, 'USD') is None
+    assert make_price('NaN', 'USD') is None
+    assert make_price(float('inf'), 'USD') is None
+    assert str(make_price(12, 7)) == "12.00"
+
+def test_parse_product_from_meta_tags():
+    html = """<html><head><meta property="og:title" content="Double Knee Pant">
+    <meta property="product:price:amount" content="140.00"><meta property="product:price:currency" content="USD">
+    </head><body><h1>FA</h1></body></html>"""
+    parser = ProductParser('http://example.com')
+    parser.soup = BeautifulSoup(html, 'html.parser')
+    parser.parse_product_name()
+    parser.parse_product_price()
+
+    assert parser.product_name == "Double Knee Pant"
+    assert parser.product_price == "$140.00"
+    assert parser.name_source == parser.price_source == 'meta'
+
+def test_parse_product_falls_back_to_dom():
+    parser = ProductParser('http://example.com')
+    parser.soup = BeautifulSoup(PRODUCT_HTML, 'html.parser')
+    parser.parse_product_name()
+    parser.parse_product_price()
+
+    assert parser.name_source == parser.price_source == 'dom'
+
+def test_shopify_product_url():
+    assert shopify_product_url('https://kith.com/collections/mens-footwear/products/aaih3432?variant=1') == 'https://kith.com/collections/mens-footwear/products/aaih3432.js'
+    assert shopify_product_url('https://www.asos.com/asos-design/prd/205945056') is None
+
+def test_get_product_info_from_shopify_json(mocker):
+    mock_response = mocker.Mock()
+    mock_response.json.return_value = {'title': 'UB8-S GT-2160', 'price': 1980000}
+    mock_response.cookies = {'cart_currency': 'JPY'}
+    get = mocker.patch('requests.get', return_value=mock_response)
+
+    parser = ProductParser('https://shop-jp.doverstreetmarket.com/collections/asics/products/asics-ub8-s-gt-2160-400', use_shopify_json=True)
+
+    assert parser.get_product_info() == {'name': 'UB8-S GT-2160', 'price': '¥19800.00'}
+    assert parser.price_source == 'shopify'
+    assert get.call_count == 1
+
+def test_get_product_info_shopify_json_falls_back_to_page(mocker):
+    not_shopify = mocker.Mock()
+    not_shopify.raise_for_status.side_effect = requests.exceptions.HTTPError("404 Not Found")
+    page = mocker.Mock()
+    page.text = PRODUCT_HTML
+    mocker.patch('requests.get', side_effect=[not_shopify, page])
+
+    parser = ProductParser('https://example.com/products/thing', use_shopify_json=True)
+
+    assert parser.get_product_info() == {'name': "Test Product", 'price': "$19.99"}
+    assert parser.price_source == 'dom'
+
+
+def test_get_product_info_shopify_json_without_currency_uses_page(mocker):
+    shopify = mocker.Mock()
+    shopify.json.return_value = {'title': 'Test Product', 'price': 29500}
+    shopify.cookies = {}
+    page = mocker.Mock(status_code=200, text=PRODUCT_HTML, headers={})
+    mocker.patch('requests.get', side_effect=[shopify, page])
+
+    parser = ProductParser('https://kith.com/products/thing', use_shopify_json=True)
+
+    assert parser.get_product_info() == {'name': "Test Product", 'price': "$19.99"}
+    assert parser.price_source == 'dom'
+
+
+@pytest.mark.skipif(not html_backends.is_available('lxml'), reason="lxml is not installed")
+def test_lxml_backend_matches_html_parser_on_unittest_corpus():
+    corpus = load_unittest_corpus(__file__)
+
+    assert len(corpus) > 50
+    for html in corpus:
+        assert extract(html, 'lxml') == extract(html, 'html.parser'), html
+
+def test_unknown_backend_falls_back_to_html_parser():
+    parser = ProductParser('http://example.com', backend='no-such-parser')
+    parser.load_html(PRODUCT_HTML)
+
+    assert html_backends.resolve_backend('no-such-parser') == 'html.parser'
+    assert parser.get_product_info() == {'name': "Test Product", 'price': "$19.99"}
+    with pytest.raises(ValueError):
+        html_backends.set_default_backend('no-such-parser')
+
+
+HEAVY_TAIL = '<script>var state = "' + 'x' * 4_000_000 + '";</script></body></html>'
+
+def test_streaming_extractor_stops_early():
+    html = '<html><head><title>Shop</title></head><body><h1>Test <b>Product</b></h1><span>Only $19.99</span>' + HEAVY_TAIL
+    data = html.encode('utf-8')
+    extractor = StreamingExtractor('utf-8', stop_on_dom=True)
+    for start in range(0, len(data), 16384):
+        if extractor.feed_bytes(data[start:start + 16384]):
+            break
+
+    assert extractor.done
+    assert (extractor.name, str(extractor.price)) == ("TestProduct", "$19.99")
+    assert extractor.bytes_read < 32768
+
+def test_streaming_extractor_prefers_meta():
+    html = ('<html><head><meta property="og:title" content="Hermosa"><meta property="product:price:amount" content="495.00">'
+            '<meta property="product:price:currency" content="EUR"></head><body><h1>Palm Angels</h1><span>$1</span>')
+    extractor = StreamingExtractor('utf-8', stop_on_dom=True)
+
+    assert extractor.feed_bytes(html.encode('utf-8'))
+    assert (extractor.name, str(extractor.price), extractor.price_source) == ("Hermosa", "€495.00", 'meta')
+
+def test_streaming_extractor_meta_is_provisional():
+    html = ('<html><head><meta property="og:title" content="Hermosa Sneakers | Farfetch">'
+            '<meta property="product:price:amount" content="495.00"><meta property="product:price:currency" content="EUR">'
+            '</head><body><h1>Palm Angels</h1><span>$1</span>')
+    json_ld = ('<script type="application/ld+json">{"@type": "Product", "name": "Hermosa Sneakers", '
+               '"offers": {"price": "450.00", "priceCurrency": "EUR"}}</script></body></html>')
+    extractor = StreamingExtractor('utf-8')
+
+    assert not extractor.feed_bytes(html.encode('utf-8'))
+    assert extractor.feed_bytes(json_ld.encode('utf-8'))
+    assert (extractor.name, str(extractor.price), extractor.price_source) == ("Hermosa Sneakers", "€450.00", 'json-ld')
+
+def test_streaming_extractor_prefers_late_json_ld():
+    json_ld = ('<script type="application/ld+json">{"@type": "Product", "name": "Hermosa", '
+               '"offers": {"price": "495.00", "priceCurrency": "EUR"}}</script>')
+    html = '<html><head></head><body><h1>Palm Angels</h1><span>$1</span><p>reviews</p>' + json_ld + '</body></html>'
+    extractor = StreamingExtractor('utf-8')
+
+    assert not extractor.feed_bytes(html[:len(html) // 2].encode('utf-8'))
+    assert extractor.feed_bytes(html[len(html) // 2:].encode('utf-8'))
+    assert (extractor.name, str(extractor.price), extractor.price_source) == ("Hermosa", "€495.00", 'json-ld')
+
+def test_streaming_matches_full_mode_on_corpus():
+    corpus = synthetic_corpus()
+
+    result = asyncio.run(bench_corpus_measure(corpus, 'html.parser', 'streaming', repeat=1, concurrency=2))
+
+    assert result['failures'] == []
+
+def test_get_product_info_streaming_falls_back(mocker):
+    response = mocker.MagicMock()
+    response.__enter__.return_value = response
+    response.encoding = 'utf-8'
+    response.iter_content.return_value = iter([b'<html><body><h2>Second</h2>', b'<span>$5</span></body></html>'])
+    mocker.patch('requests.get', return_value=response)
+
+    parser = ProductParser('http://example.com', streaming=True)
+
+    assert parser.get_product_info() == {'name': "Second", 'price': "$5"}
+    assert parser.soup is not None
+
+def test_get_product_info_async_streaming_cancels_download():
+    total = len(HEAVY_TAIL)
+
+    async def handler(request):
+        response = web.StreamResponse(headers={'Content-Type': 'text/html; charset=utf-8'})
+        await response.prepare(request)
+        await response.write(b'<html><head></head><body><h1>Test Product</h1><span>$19.99</span>')
+        tail = HEAVY_TAIL.encode('utf-8')
+        try:
+            for start in range(0, len(tail), 65536):
+                await response.write(tail[start:start + 65536])
+                await asyncio.sleep(0.001)
+        except ConnectionResetError:
+            pass
+        return response
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        fetcher = AsyncFetcher()
+        parser = ProductParser(f'{base_url}/product', streaming='dom')
+        try:
+            product_info = await parser.get_product_info_async(fetcher)
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+        return parser, product_info
+
+    parser, product_info = asyncio.run(scenario())
+
+    assert product_info == {'name': "Test Product", 'price': "$19.99"}
+    assert parser.price_source == 'dom'
+    assert parser.bytes_downloaded < total / 10
+
+
+def test_single_pass_extraction_matches_legacy_on_unittest_corpus():
+    for html in load_unittest_corpus(__file__):
+        soup = BeautifulSoup(html, 'html.parser')
+        assert single_pass_extract(soup) == legacy_extract(soup), html
+
+def test_parse_product_name_by_class_single_walk(mocker):
+    html = '<html><body><p class="promo name">Promo</p><p class="product-title">Test Product</p><p>$19.99</p></body></html>'
+    parser = ProductParser('http://example.com')
+    parser.soup = BeautifulSoup(html, 'html.parser')
+    find = mocker.spy(parser.soup, 'find')
+    parser.parse_product_name()
+    parser.parse_product_price()
+
+    assert parser.product_name == "Test Product"
+    assert parser.product_price == "Price not found"
+    assert find.call_count == 0
+
+
+@pytest.mark.parametrize("text, amount, currency, display", [
+    ("$1,234.56", "1234.56", "USD", "$1,234.56"),
+    ("1 234,56 €", "1234.56", "EUR", "1 234,56 €"),
+    ("1.234,56 EUR", "1234.56", "EUR", "1.234,56 EUR"),
+    ("USD 123", "123", "USD", "USD 123"),
+    ("₽123.45", "123.45", "RUB", "₽123.45"),
+    ("12 990 руб.", "12990", "RUB", "12 990 руб."),
+    ("12 990 рублей", "12990", "RUB", "12 990 рублей"),
+    ("99 zł", "99", "PLN", "99 zł"),
+    ("CHF 1'299.90", "1299.90", "CHF", "CHF 1'299.90"),
+    ("€123,45", "123.45", "EUR", "€123,45"),
+    ("from 19,99€ (was 29,99€)", "19.99", "EUR", "19,99€"),
+    ("-$5", "-5", "USD", "-$5"),
+])
+def test_parse_price_locales(text, amount, currency, display):
+    assert parse_price(text) == Price(Decimal(amount), currency, display)
+
+@pytest.mark.parametrize("text", ["Size 42", "N/A", "$", "SALE", "", None, "42 рубашки", "7 złotych"])
+def test_parse_price_without_price(text):
+    assert parse_price(text) is None
+
+def test_parse_product_price_sets_price_value():
+    parser = ProductParser('http://example.com')
+    parser.soup = BeautifulSoup('<html><span>EUR</span><span>1.299,00 €</span></html>', 'html.parser')
+    parser.parse_product_price()
+
+    assert parser.product_price == "1.299,00 €"
+    assert parser.price_value == Price(Decimal("1299.00"), "EUR", "1.299,00 €")
+
+def test_parse_many_async_limits_hosts_and_yields_all():
+    active = {'now': 0, 'max': 0}
+
+    async def handler(request):
+        active['now'] += 1
+        active['max'] = max(active['max'], active['now'])
+        await asyncio.sleep(0.02)
+        active['now'] -= 1
+        if request.path == '/missing':
+            return web.Response(status=404)
+        return web.Response(text=PRODUCT_HTML, content_type='text/html')
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        fetcher = AsyncFetcher()
+        urls = [f'{base_url}/product/{i}' for i in range(6)] + [f'{base_url}/missing']
+        try:
+            return [item async for item in ProductParser.parse_many_async(urls, concurrency=4, per_host=2, fetcher=fetcher)]
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+    results = dict(asyncio.run(scenario()))
+
+    assert len(results) == 7
+    assert active['max'] == 2
+    assert results[next(url for url in results if url.endswith('/product/0'))] == {'name': "Test Product", 'price': "$19.99"}
+    assert results[next(url for url in results if url.endswith('/missing'))]['price'] == "Price not found"
+
+def test_parse_many_async_deadline_cancels_slow_pages():
+    async def handler(request):
+        if request.path == '/slow':
+            await asyncio.sleep(1)
+        return web.Response(text=PRODUCT_HTML, content_type='text/html')
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        fetcher = AsyncFetcher()
+        try:
+            return [item async for item in ProductParser.parse_many_async(
+                [f'{base_url}/fast', f'{base_url}/slow'], deadline=0.3, fetcher=fetcher)]
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+    results = asyncio.run(scenario())
+
+    assert results[0][0].endswith('/fast') and results[0][1]['name'] == "Test Product"
+    assert results[1][0].endswith('/slow') and results[1][1] is None
+
+def test_parse_many_yields_from_blocking_code(mocker):
+    async def fake_info(self, fetcher=None, executor=None):
+        if self.url.endswith('bad'):
+            raise ValueError("boom")
+        return {'name': self.url, 'price': "$1"}
+
+    mocker.patch.object(ProductParser, 'get_product_info_async', fake_info)
+
+    results = dict(ProductParser.parse_many(iter(['http://a.com/1', 'http://b.com/2', 'http://b.com/bad']), concurrency=2))
+
+    assert results == {
+        'http://a.com/1': {'name': 'http://a.com/1', 'price': "$1"},
+        'http://b.com/2': {'name': 'http://b.com/2', 'price': "$1"},
+        'http://b.com/bad': None,
+    }
+
+def test_parse_many_async_deadline_reports_unstarted_urls(mocker):
+    async def slow_info(self, fetcher=None, executor=None):
+        await asyncio.sleep(1)
+
+    mocker.patch.object(ProductParser, 'get_product_info_async', slow_info)
+    urls = [f'http://shop{i}.com/item' for i in range(10)]
+
+    async def scenario():
+        return [item async for item in ProductParser.parse_many_async(iter(urls), concurrency=2, deadline=0.2)]
+
+    results = asyncio.run(scenario())
+
+    assert sorted(url for url, info in results) == sorted(urls)
+    assert all(info is None for url, info in results)
+
+def test_parse_many_async_gives_free_slots_to_other_shops(mocker):
+    running = defaultdict(int)
+    started = []
+
+    async def fake_info(self, fetcher=None, executor=None):
+        host = self.url.split('/')[2]
+        running[host] += 1
+        started.append((host, sum(running.values())))
+        assert running[host] <= 2
+        await asyncio.sleep(0.02)
+        running[host] -= 1
+        return {'name': self.url, 'price': "$1"}
+
+    mocker.patch.object(ProductParser, 'get_product_info_async', fake_info)
+    urls = [f'http://a.com/{i}' for i in range(8)] + [f'http://b.com/{i}' for i in range(4)]
+
+    async def scenario():
+        return [item async for item in ProductParser.parse_many_async(urls, concurrency=4, per_host=2)]
+
+    results = asyncio.run(scenario())
+
+    assert len(results) == 12
+    assert started[:4] == [('a.com', 1), ('a.com', 2), ('b.com', 3), ('b.com', 4)]
+
+def test_parse_many_respects_open_circuit(mocker):
+    limiter = ratelimit_module.get_host_limiter()
+    for _ in range(limiter.failure_threshold):
+        limiter.record_error('https://stockx.com/item', aiohttp.ClientConnectionError())
+    get = mocker.patch.object(aiohttp.ClientSession, 'get')
+
+    results = dict(ProductParser.parse_many(['https://stockx.com/air-jordan-4'], retry_policy=RetryPolicy(retries=0)))
+
+    assert results['https://stockx.com/air-jordan-4']['price'] == "Price not found"
+    assert not get.called
+
+def test_get_product_info_async_in_process_pool():
+    async def handler(request):
+        return web.Response(text=PRODUCT_HTML, content_type='text/html')
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        fetcher = AsyncFetcher()
+        parser = ProductParser(f'{base_url}/product')
+        try:
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'), initializer=warm_parse_worker) as executor:
+                return parser, await parser.get_product_info_async(fetcher, executor)
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+    parser, product_info = asyncio.run(scenario())
+
+    assert product_info == {'name': "Test Product", 'price': "$19.99"}
+    assert parser.soup is None
+    assert parser.price_value.amount == Decimal("19.99")
+    assert parser.name_source == 'dom'
+
+def test_crawler_runs_extract_in_executor():
+    async def handler(request):
+        return web.Response(text='{"id": 1} {"id": 2}')
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        crawler = PageCrawler(base_url + '/page/{page}/', executor=ThreadPoolExecutor(1))
+        try:
+            return [item async for item in crawler.crawl(main_poizion.extract_products, [1, 2])]
+        finally:
+            await crawler.close()
+            await runner.cleanup()
+
+    results = sorted(asyncio.run(scenario()))
+
+    assert results == [(1, [{'id': 1}, {'id': 2}]), (2, [{'id': 1}, {'id': 2}])]
+
+@pytest.fixture
+def shop_profile():
+    site_profiles.register_profile('profile-shop.test', name='.pdp h2.title', price='.pdp .now',
+                                   json='script#state', name_path='product.title', price_path='product.variants.0.price',
+                                   currency_path='currency')
+    yield
+    del site_profiles.PROFILES['profile-shop.test']
+    site_profiles.profile_for_host.cache_clear()
+
+def test_site_profile_json_path(shop_profile):
+    html = ('<html><h1>Related</h1><span>$1.00</span><script id="state" type="application/json">'
+            '{"currency": "EUR", "product": {"title": "Profile Tee", "variants": [{"price": "45.00"}]}}</script></html>')
+    parser = ProductParser('https://www.profile-shop.test/p/1')
+    parser.parse_page(html)
+
+    assert (parser.product_name, parser.name_source) == ("Profile Tee", 'profile')
+    assert (parser.product_price, parser.price_source) == ("€45.00", 'profile')
+
+def test_site_profile_selectors_then_fallback(shop_profile):
+    html = '<html><h1>Related</h1><div class="pdp"><h2 class="title">Selector Tee</h2></div><span>$9.99</span></html>'
+    parser = ProductParser('https://eu.profile-shop.test/p/1')
+    parser.parse_page(html)
+
+    assert (parser.product_name, parser.name_source) == ("Selector Tee", 'profile')
+    assert (parser.product_price, parser.price_source) == ("$9.99", 'dom')
+
+@pytest.fixture
+def shopify_profile():
+    site_profiles.register_profile('shopify-shop.test', shopify=True)
+    yield
+    del site_profiles.PROFILES['shopify-shop.test']
+    site_profiles.profile_for_host.cache_clear()
+
+def test_site_profile_lookup_by_domain(shopify_profile):
+    assert site_profiles.get_profile('https://shop-jp.shopify-shop.test/products/x').domain == 'shopify-shop.test'
+    assert site_profiles.get_profile('https://example.com/') is None
+    assert ProductParser('https://shopify-shop.test/products/aaih3432').use_shopify_json
+    assert not ProductParser('https://www.asos.com/prd/1').use_shopify_json
+
+def test_user_agent_pool_is_sticky_per_host():
+    pool = UserAgentPool(['agent-a', 'agent-b', 'agent-c'], rng=random.Random(3))
+    first = pool.agent_for('https://kith.com/products/1')
+
+    assert all(pool.agent_for('https://kith.com/products/2') == first for _ in range(20))
+    assert pool.headers_for('https://kith.com/') == {'User-Agent': first}
+    assert {pool.agent_for(f'https://shop{i}.test/') for i in range(30)} == {'agent-a', 'agent-b', 'agent-c'}
+
+def test_user_agent_pool_loads_file_once(tmp_path, mocker):
+    ua_file = tmp_path / 'agents.txt'
+    ua_file.write_text('# offline list\nAgent/1.0\n\nAgent/2.0\n', encoding='utf-8')
+    load = mocker.spy(user_agents, 'load_user_agents')
+    pool = UserAgentPool(path=str(ua_file))
+
+    agents = {pool.agent_for(f'https://shop{i}.test/') for i in range(20)}
+
+    assert agents == {'Agent/1.0', 'Agent/2.0'}
+    assert load.call_count == 1
+
+def test_product_parser_does_not_build_user_agent(mocker):
+    fake_user_agent = mocker.patch('fake_useragent.UserAgent')
+    mocker.patch.object(user_agents, '_default_pool', UserAgentPool(['Agent/1.0']))
+
+    headers = [ProductParser(f'http://example.com/{i}').headers for i in range(3)]
+
+    assert headers == [{'User-Agent': 'Agent/1.0'}] * 3
+    fake_user_agent.assert_not_called()
+
+def conditional_handler(requests_seen, etag='"v1"'):
+    async def handler(request):
+        requests_seen.append(request.headers.get('If-None-Match'))
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=PRODUCT_HTML, content_type='text/html', headers={'ETag': etag})
+    return handler
+
+def test_http_cache_reuses_result_on_304(tmp_path):
+    requests_seen = []
+
+    async def scenario():
+        runner, base_url = await start_local_server(conditional_handler(requests_seen))
+        fetcher = AsyncFetcher()
+        http_cache = HTTPCache(str(tmp_path))
+        try:
+            first = await ProductParser(f'{base_url}/product', http_cache=http_cache).get_product_info_async(fetcher)
+            parser = ProductParser(f'{base_url}/product?utm_source=tg', http_cache=http_cache)
+            second = await parser.get_product_info_async(fetcher)
+            return first, second, parser, http_cache
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+    first, second, parser, http_cache = asyncio.run(scenario())
+
+    assert first == second == {'name': "Test Product", 'price': "$19.99"}
+    assert requests_seen == [None, '"v1"']
+    assert parser.soup is None
+    assert parser.price_value == Price(Decimal("19.99"), "USD", "$19.99")
+    assert http_cache.revalidated == 1
+
+def test_http_cache_sync_fetch_page_uses_stored_body(tmp_path, mocker):
+    http_cache = HTTPCache(str(tmp_path))
+    http_cache.store('http://example.com/p', PRODUCT_HTML, etag='"v1"')
+    response = mocker.Mock(status_code=304, text='', headers={})
+    get = mocker.patch('requests.get', return_value=response)
+
+    parser = ProductParser('http://example.com/p', http_cache=http_cache)
+    parser.fetch_page()
+
+    assert get.call_args.kwargs['headers']['If-None-Match'] == '"v1"'
+    assert parser.soup.find('h1').get_text() == "Test Product"
+
+def test_http_cache_evicts_least_recently_used(tmp_path):
+    http_cache = HTTPCache(str(tmp_path), max_bytes=250)
+    for i in range(3):
+        http_cache.store(f'http://example.com/{i}', 'x' * 100, etag=f'"{i}"')
+        time.sleep(0.01)
+
+    assert http_cache.get('http://example.com/0') is None
+    assert http_cache.body('http://example.com/2') == 'x' * 100
+    assert http_cache.size() == 200
+    assert HTTPCache(str(tmp_path), max_bytes=250).size() == 200
+
+def test_http_cache_skips_pages_without_validators(tmp_path):
+    http_cache = HTTPCache(str(tmp_path))
+    http_cache.store('http://example.com/p', PRODUCT_HTML)
+
+    assert http_cache.get('http://example.com/p') is None
+
+def test_content_key_ignores_volatile_tokens(shopify_profile):
+    page = '<html><meta name="csrf-token" content="{token}"><script nonce="{token}">var s = {{"requestId": "{token}"}};</script><h1>Tee</h1></html>'
+
+    assert content_key(page.format(token='abc')) == content_key(page.format(token='xyz'))
+    assert content_key(page.format(token='abc')) != content_key(page.format(token='abc').replace('Tee', 'Hat'))
+    assert content_key(page, site_profiles.get_profile('https://shopify-shop.test/')).startswith('shopify-shop.test:')
+
+def test_result_store_skips_parsing_unchanged_html(mocker):
+    get = mock_product_response(mocker, PRODUCT_HTML.replace('<h1>', '<h1 data-request-id="1">'))
+    result_store = TTLCache(maxsize=16)
+    first = ProductParser('http://example.com/a', result_store=result_store).get_product_info()
+
+    get.return_value.text = PRODUCT_HTML.replace('<h1>', '<h1 data-request-id="2">')
+    make_soup = mocker.spy(ProductParser_module, 'make_soup')
+    parser = ProductParser('http://example.com/b', result_store=result_store)
+    second = parser.get_product_info()
+
+    assert first == second == {'name': "Test Product", 'price': "$19.99"}
+    assert make_soup.call_count == 0
+    assert parser.price_value == Price(Decimal("19.99"), "USD", "$19.99")
+    assert result_store.stats()['hits'] == 1
+
+def test_corpus_benchmark_reports_accuracy_and_latency():
+    corpus = [entry for entry in synthetic_corpus() if entry['file'] == 'rub.html']
+
+    result = asyncio.run(bench_corpus_measure(corpus, 'html.parser', 'full', repeat=2, concurrency=2))
+
+    assert result['accuracy'] == {'name': 1.0, 'price': 1.0}
+    assert result['failures'] == []
+    assert set(result['latency_ms']['total']) == {'p50', 'p90', 'p99'}
+    assert result['throughput_pages_s'] > 0
+
+@pytest.fixture
+def metrics_registry():
+    registry = metrics.enable()
+    yield registry
+    metrics.disable()
+
+def test_metrics_off_by_default():
+    assert not metrics.enabled()
+    assert metrics.timer('parser_stage_seconds', stage='parse') is metrics.NULL_TIMER
+    metrics.inc('fetch_bytes_total', 10)
+
+def test_metrics_registry_renders_prometheus_text():
+    registry = metrics.Registry(buckets=(0.1, 1))
+    registry.inc('fetch_bytes_total', 100, ())
+    registry.observe('parser_stage_seconds', 0.05, (('stage', 'parse'),))
+    registry.observe('parser_stage_seconds', 0.5, (('stage', 'parse'),))
+
+    assert registry.render().splitlines() == [
+        '# TYPE fetch_bytes_total counter',
+        'fetch_bytes_total 100',
+        '# TYPE parser_stage_seconds histogram',
+        'parser_stage_seconds_bucket{stage="parse",le="0.1"} 1',
+        'parser_stage_seconds_bucket{stage="parse",le="1"} 2',
+        'parser_stage_seconds_bucket{stage="parse",le="+Inf"} 2',
+        'parser_stage_seconds_sum{stage="parse"} 0.55',
+        'parser_stage_seconds_count{stage="parse"} 2',
+    ]
+
+def test_metrics_cover_fetch_parse_and_extract(metrics_registry):
+    async def handler(request):
+        return web.Response(text=PRODUCT_HTML, content_type='text/html')
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        metrics_runner = await metrics.start_http_server(0, host='127.0.0.1')
+        fetcher = AsyncFetcher()
+        try:
+            await ProductParser(f'{base_url}/product').get_product_info_async(fetcher)
+            metrics_url = f'http://{metrics_runner.addresses[0][0]}:{metrics_runner.addresses[0][1]}/metrics'
+            return await fetcher.fetch_text(metrics_url)
+        finally:
+            await fetcher.close()
+            await metrics_runner.cleanup()
+            await runner.cleanup()
+
+    text = asyncio.run(scenario())
+
+    for stage in ('fetch', 'parse', 'extract_name', 'extract_price'):
+        assert f'parser_stage_seconds_count{{stage="{stage}"}} 1' in text
+    assert 'fetch_phase_seconds_count{phase="connect"}' in text
+    assert f'fetch_bytes_total {len(PRODUCT_HTML)}' in text
+    assert 'parser_extract_source_total{field="price",source="dom"} 1' in text
+
+def test_slow_page_sampler_saves_html_and_profile(tmp_path, mocker):
+    mock_product_response(mocker)
+    sampler = SlowPageSampler(str(tmp_path), threshold=0)
+    parser = ProductParser('http://example.com/slow', slow_pages=sampler)
+
+    assert parser.get_product_info() == {'name': "Test Product", 'price': "$19.99"}
+    sampler.close()
+
+    corpus = load_samples(str(tmp_path))
+    assert len(corpus) == 1
+    assert corpus[0]['html'] == PRODUCT_HTML
+    assert (corpus[0]['name'], corpus[0]['price']) == ("Test Product", "$19.99")
+    sample = json.loads((tmp_path / corpus[0]['file'].replace('.page.html', '.json')).read_text(encoding='utf-8'))
+    assert sample['stage'] == 'fetch+parse'
+    assert pstats.Stats(str(tmp_path / sample['profile'])).total_calls > 0
+
+def test_slow_page_sampler_keeps_newest_samples(tmp_path):
+    sampler = SlowPageSampler(str(tmp_path), threshold=0, max_samples=2, max_pending=10)
+    parse = lambda url, html, backend: {'name': html, 'price': None}
+    for i in range(4):
+        sampler.check(f'http://example.com/{i}', f'page {i}', None, 1.0, parse)
+    sampler.close()
+
+    assert [entry['html'] for entry in load_samples(str(tmp_path))] == ['page 2', 'page 3']
+    assert len(os.listdir(tmp_path)) == 6
+
+def test_slow_page_sampler_ignores_fast_pages(tmp_path):
+    sampler = SlowPageSampler(str(tmp_path), threshold=5)
+
+    assert sampler.check('http://example.com/', PRODUCT_HTML, 0.1, 0.2, parse_html_result) is None
+    assert os.listdir(tmp_path) == []
+
+def test_host_limiter_backs_off_on_429_and_recovers():
+    now = [0.0]
+    limiter = HostRateLimiter(rate=4, burst=1, timer=lambda: now[0])
+    url = 'https://stockx.com/air-jordan-4'
+
+    assert limiter.reserve(url) == 0
+    limiter.record_response(url, 429, {'Retry-After': '3'})
+
+    assert limiter.bucket('stockx.com').rate == 2
+    assert limiter.reserve(url) == 3
+    assert limiter.reserve('https://kith.com/') == 0
+
+    for _ in range(20):
+        limiter.record_response(url, 200)
+    assert limiter.bucket('stockx.com').rate == 4
+
+def test_circuit_breaker_fails_fast_then_half_opens():
+    now = [0.0]
+    limiter = HostRateLimiter(rate=100, burst=100, failure_threshold=3, reset_timeout=10, timer=lambda: now[0])
+    url = 'https://www.farfetch.com/item'
+    for _ in range(3):
+        limiter.reserve(url)
+        limiter.record_error(url, aiohttp.ClientConnectionError())
+
+    with pytest.raises(CircuitOpenError):
+        limiter.reserve(url)
+    assert limiter.reserve('https://kith.com/') == 0
+
+    now[0] = 10.0
+    assert limiter.reserve(url) == 0
+    assert limiter.breaker('www.farfetch.com').state == 'half-open'
+    with pytest.raises(CircuitOpenError):
+        limiter.reserve(url)
+
+    limiter.record_response(url, 503)
+    assert limiter.breaker('www.farfetch.com').state == 'open'
+
+    now[0] = 20.0
+    limiter.reserve(url)
+    limiter.record_response(url, 200)
+    assert limiter.breaker('www.farfetch.com').state == 'closed'
+
+def test_fetcher_stops_calling_dead_host():
+    hits = []
+
+    async def handler(request):
+        hits.append(request.path)
+        return web.Response(status=503)
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        fetcher = AsyncFetcher(rate_limiter=HostRateLimiter(rate=100, burst=100, failure_threshold=2))
+        errors = []
+        try:
+            for _ in range(4):
+                try:
+                    await fetcher.fetch_text(f'{base_url}/item')
+                except Exception as err:
+                    errors.append(type(err))
+            return errors
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+    errors = asyncio.run(scenario())
+
+    assert len(hits) == 2
+    assert errors == [aiohttp.ClientResponseError] * 2 + [CircuitOpenError] * 2
+
+def test_retry_after_seconds():
+    assert retry_after_seconds('120') == 120
+    assert retry_after_seconds('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert retry_after_seconds('soon') is None
+
+def test_retry_policy_jitter_and_deadline():
+    policy = RetryPolicy(retries=5, backoff=1, max_backoff=4, rng=lambda: 0.5)
+    assert [policy.delay(attempt) for attempt in range(4)] == [0.5, 1, 2, 2]
+    assert RetryPolicy(backoff=1, jitter=False).delay(1) == 2
+
+    timeout = requests.exceptions.Timeout()
+    assert policy.next_delay(timeout, 0, 0) == 0.5
+    assert policy.next_delay(timeout, 5, 0) is None
+    assert policy.next_delay(ValueError(), 0, 0) is None
+
+    policy = RetryPolicy(retries=5, backoff=1, deadline=3, rng=lambda: 1)
+    assert policy.next_delay(timeout, 1, 0.5) == 2
+    assert policy.next_delay(timeout, 1, 1.5) is None
+    assert policy.attempt_timeout(15, 1) == 2
+
+def test_is_transient_error_for_requests():
+    response = Mock(status_code=503, headers={})
+    assert is_transient_error(requests.exceptions.HTTPError(response=response))
+    assert is_transient_error(requests.exceptions.ConnectionError())
+    response.status_code = 404
+    assert not is_transient_error(requests.exceptions.HTTPError(response=response))
+
+def test_fetch_page_retries_timeout(mocker):
+    response = mocker.Mock(status_code=200, text=PRODUCT_HTML, content=PRODUCT_HTML.encode(), headers={})
+    get = mocker.patch('requests.get', side_effect=[requests.exceptions.Timeout, response])
+
+    parser = ProductParser("http://retry.example.com/item", retry_policy=RetryPolicy(retries=2, backoff=0.01))
+    parser.fetch_page()
+    parser.parse_product_price()
+
+    assert get.call_count == 2
+    assert parser.product_price == "$19.99"
+
+def test_fetch_page_does_not_retry_404(mocker):
+    response = mocker.Mock(status_code=404, headers={})
+    response.raise_for_status.side_effect = requests.exceptions.HTTPError(response=response)
+    get = mocker.patch('requests.get', return_value=response)
+
+    parser = ProductParser("http://retry.example.com/missing", retry_policy=RetryPolicy(retries=2, backoff=0.01))
+    parser.fetch_page()
+
+    assert get.call_count == 1
+    assert parser.soup is None
+
+def test_host_latency_percentile():
+    latency = HostLatency(window=100, min_samples=10)
+    for num in range(9):
+        latency.record('kith.com', num / 100)
+    assert latency.percentile('kith.com') is None
+    for num in range(9, 100):
+        latency.record('kith.com', num / 100)
+    assert latency.percentile('kith.com') == 0.95
+    assert latency.percentile('stockx.com') is None
+
+def test_fetcher_hedges_slow_request():
+    calls = []
+
+    async def handler(request):
+        calls.append(request.path)
+        if len(calls) == 1:
+            await asyncio.sleep(2)
+        return web.Response(text=PRODUCT_HTML, content_type='text/html')
+
+    async def scenario():
+        runner, base_url = await start_local_server(handler)
+        latency = HostLatency(min_samples=1)
+        latency.record('127.0.0.1', 0.05)
+        fetcher = AsyncFetcher(hedge=True, hedge_ratio=1, latency=latency)
+        try:
+            started = time.perf_counter()
+            html = await fetcher.fetch_text(f'{base_url}/item')
+            return html, time.perf_counter() - started, fetcher.hedged
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+    html, elapsed, hedged = asyncio.run(scenario())
+
+    assert html == PRODUCT_HTML
+    assert elapsed < 1.5
+    assert hedged == 1
+    assert len(calls) == 2
+
+def test_fetcher_hedge_budget():
+    fetcher = AsyncFetcher(hedge=True, hedge_ratio=0.1)
+    fetcher.hedgeable, fetcher.hedged = 9, 1
+    fetcher.request = AsyncMock(return_value='html')
+    fetcher.latency.percentile = Mock(return_value=0.01)
+
+    assert asyncio.run(fetcher.hedged_request('https://kith.com/item', None)) == 'html'
+    assert fetcher.request.call_count == 1
+    assert fetcher.hedged == 1
+
+def test_fetcher_hedge_cancelled_with_caller():
+    cancelled = []
+    fetcher = AsyncFetcher(hedge=True, hedge_ratio=1)
+    fetcher.latency.percentile = Mock(return_value=10)
+
+    async def slow_request(*args):
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    fetcher.request = slow_request
+
+    async def scenario():
+        caller = asyncio.ensure_future(fetcher.hedged_request('https://kith.com/item', None))
+        await asyncio.sleep(0.05)
+        caller.cancel()
+        await asyncio.gather(caller, return_exceptions=True)
+        await asyncio.sleep(0)
+        return list(cancelled)
+
+    assert asyncio.run(scenario()) == [True]
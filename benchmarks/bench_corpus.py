@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from aiohttp import web
+
+from benchmarks.bench_parser_backends import heavy_page
+from fetcher import AsyncFetcher
+from html_backends import available_backends
+from ProductParser import TEST_URLS, ProductParser
+from site_profiles import get_profile
+from slow_pages import load_samples
+from user_agents import get_user_agents
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'corpus')
+MODES = ('full', 'streaming')
+
+
+def load_corpus(directory=CORPUS_DIR):
+    # manifest.json lists {"file", "url", "name", "price"} per page, see --record
+    path = os.path.join(directory, 'manifest.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        corpus = json.load(f)
+    for entry in corpus:
+        with open(os.path.join(directory, entry['file']), encoding='utf-8') as f:
+            entry['html'] = f.read()
+    return corpus
+
+
+def record_corpus(directory=CORPUS_DIR):
+    # saves the TEST_URLS pages and what the parser finds on them today;
+    # check the expected name/price in manifest.json by hand before relying on it
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for num, url in enumerate(TEST_URLS):
+        try:
+            response = requests.get(url, headers=get_user_agents().headers_for(url), timeout=30)
+            response.raise_for_status()
+        except Exception as err:
+            print(f"skipped {url}: {err}")
+            continue
+        file_name = f'{num:02d}-{urlsplit(url).hostname}.html'
+        with open(os.path.join(directory, file_name), 'w', encoding='utf-8') as f:
+            f.write(response.text)
+        parser = ProductParser(url)
+        parser.parse_page(response.text)
+        corpus.append({'file': file_name, 'url': url, 'name': parser.product_name, 'price': parser.product_price})
+        print(f"{file_name}: {parser.product_name} / {parser.product_price}")
+    with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(corpus, f, ensure_ascii=False, indent=2)
+
+
+def synthetic_corpus():
+    # stand-ins shaped like the shop pages, used until a corpus is recorded
+    json_ld = ('<script type="application/ld+json">{"@context": "https://schema.org", "@type": "Product", '
+               '"name": "Fine Knit Boat Neck Top", "offers": {"@type": "Offer", "price": "32.00", "priceCurrency": "GBP"}}</script>')
+    meta = ('<meta property="og:title" content="Coverstitch Sherpa Fleece">'
+            '<meta property="product:price:amount" content="180.00"><meta property="product:price:currency" content="CAD">')
+    heavy = heavy_page()
+    return [
+        {'file': 'json-ld.html', 'url': TEST_URLS[2], 'name': "Fine Knit Boat Neck Top", 'price': "£32.00",
+         'html': heavy.replace('</head>', json_ld + '</head>')},
+        {'file': 'meta.html', 'url': TEST_URLS[12], 'name': "Coverstitch Sherpa Fleece", 'price': "CAD 180.00",
+         'html': heavy.replace('<title>Shop</title>', '<title>Shop</title>' + meta)},
+        {'file': 'dom.html', 'url': TEST_URLS[5], 'name': "Hermosa Sneakers", 'price': "€495.00", 'html': heavy},
+        {'file': 'rub.html', 'url': TEST_URLS[9], 'name': "Regular Jeans Red", 'price': "12 990 руб.",
+         'html': '<html><head><title>itk</title></head><body><h1>Regular Jeans Red</h1>'
+                 + '<p>Доставка по России</p>' * 500 + '<span>12 990 руб.</span></body></html>'},
+        {'file': 'late-json-ld.html', 'url': TEST_URLS[4], 'name': "Air Jordan 4 Retro White Thunder", 'price': "$215.00",
+         'html': heavy.replace('<h1 class="product-title">Hermosa Sneakers</h1>', '').replace(
+             '</body>', json_ld.replace('Fine Knit Boat Neck Top', 'Air Jordan 4 Retro White Thunder')
+             .replace('"32.00"', '"215.00"').replace('GBP', 'USD') + '</body>')},
+        {'file': 'meta-then-json-ld.html', 'url': TEST_URLS[5], 'name': "Hermosa Sneakers", 'price': "€450.00",
+         'html': heavy.replace('<title>Shop</title>', '<title>Shop</title>' + meta.replace('Coverstitch Sherpa Fleece', 'Hermosa Sneakers | Farfetch')
+                               .replace('180.00', '495.00').replace('CAD', 'EUR')).replace(
+             '</body>', json_ld.replace('Fine Knit Boat Neck Top', 'Hermosa Sneakers')
+             .replace('"32.00"', '"450.00"').replace('GBP', 'EUR') + '</body>')},
+    ]
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {f'p{q}': round(values[min(len(values) - 1, len(values) * q // 100)] * 1000, 3) for q in (50, 90, 99)}
+
+
+async def start_server(corpus):
+    async def handler(request):
+        entry = corpus[int(request.match_info['num'])]
+        return web.Response(text=entry['html'], content_type='text/html', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/{num:\\d+}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+
+
+def make_parser(url, entry, backend, mode):
+    parser = ProductParser(url, backend=backend, streaming=mode == 'streaming')
+    # keep the shop's site profile, the local url would not match any; only
+    # html is recorded, so the Shopify JSON shortcut stays off
+    parser.profile = get_profile(entry['url'])
+    return parser
+
+
+async def measure_page(parser, fetcher, mode, timings):
+    started = time.perf_counter()
+    if mode == 'streaming':
+        extractor = await parser.fetch_page_streaming_async(fetcher)
+        timings['fetch'].append(time.perf_counter() - started)
+        if parser.apply_streaming_result(extractor):
+            timings['total'].append(time.perf_counter() - started)
+            return
+        html = extractor.text()
+    else:
+        html = await parser.fetch_html_async(fetcher)
+        timings['fetch'].append(time.perf_counter() - started)
+    parse_started = time.perf_counter()
+    parser.load_html(html)
+    extract_started = time.perf_counter()
+    parser.parse_product_name()
+    parser.parse_product_price()
+    finished = time.perf_counter()
+    timings['parse'].append(extract_started - parse_started)
+    timings['extract'].append(finished - extract_started)
+    timings['total'].append(finished - started)
+
+
+async def measure(corpus, backend, mode, repeat=3, concurrency=8):
+    runner, base_url = await start_server(corpus)
+    fetcher = AsyncFetcher()
+    timings = {'fetch': [], 'parse': [], 'extract': [], 'total': []}
+    correct = {'name': 0, 'price': 0}
+    failures = []
+    try:
+        for round_num in range(repeat):
+            for num, entry in enumerate(corpus):
+                parser = make_parser(f'{base_url}/{num}', entry, backend, mode)
+                await measure_page(parser, fetcher, mode, timings)
+                if round_num == 0:
+                    correct['name'] += parser.product_name == entry['name']
+                    correct['price'] += parser.product_price == entry['price']
+                    if (parser.product_name, parser.product_price) != (entry['name'], entry['price']):
+                        failures.append({'file': entry['file'], 'name': parser.product_name, 'price': parser.product_price})
+
+        urls = [f'{base_url}/{num}' for num in range(len(corpus))] * repeat
+        started = time.perf_counter()
+        async for _ in ProductParser.parse_many_async(urls, concurrency=concurrency, per_host=concurrency, fetcher=fetcher,
+                                                      backend=backend, streaming=mode == 'streaming'):
+            pass
+        throughput = len(urls) / (time.perf_counter() - started)
+    finally:
+        await fetcher.close()
+        await runner.cleanup()
+    return {
+        'backend': backend,
+        'mode': mode,
+        'pages': len(corpus),
+        'accuracy': {field: round(count / len(corpus), 3) for field, count in correct.items()},
+        'failures': failures,
+        'latency_ms': {stage: percentiles(values) for stage, values in timings.items()},
+        'throughput_pages_s': round(throughput, 2),
+    }
+
+
+def run_combo(corpus, backend, mode, repeat, concurrency):
+    # runs in a fresh process so peak RSS belongs to this backend and mode only
+    logging.disable(logging.WARNING)
+    result = asyncio.run(measure(corpus, backend, mode, repeat, concurrency))
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    previous = {(item['backend'], item['mode']): item for item in baseline['results']}
+    for item in report['results']:
+        old = previous.get((item['backend'], item['mode']))
+        if old is None:
+            continue
+        total, old_total = item['latency_ms']['total']['p50'], old['latency_ms']['total']['p50']
+        print(f"{item['backend']:12} {item['mode']:10} total p50 {total / old_total - 1:+7.1%}  "
+              f"throughput {item['throughput_pages_s'] / old['throughput_pages_s'] - 1:+7.1%}  "
+              f"vs {baseline.get('commit')}")
+
+
+def main(args):
+    if args.record:
+        record_corpus(args.corpus)
+        return
+    if args.slow_pages:
+        corpus, label = load_samples(args.slow_pages), 'slow-pages'
+    else:
+        corpus, label = load_corpus(args.corpus), 'recorded'
+    if corpus is None:
+        corpus, label = synthetic_corpus(), 'synthetic'
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'corpus': label,
+        'repeat': args.repeat,
+        'results': [],
+    }
+    print(f"{label} corpus: {len(corpus)} pages, {args.repeat} rounds")
+    for backend in args.backends or available_backends():
+        for mode in args.modes:
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(run_combo, corpus, backend, mode, args.repeat, args.concurrency).result()
+            report['results'].append(result)
+            latency = result['latency_ms']
+            print(f"{backend:12} {mode:10} total p50 {latency['total']['p50']:8.1f} ms  p99 {latency['total']['p99']:8.1f} ms  "
+                  f"{result['throughput_pages_s']:7.1f} pages/s  rss {result['peak_rss_mb']:6.1f} MB  "
+                  f"name {result['accuracy']['name']:.0%} price {result['accuracy']['price']:.0%}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='python -m benchmarks.bench_corpus')
+    arg_parser.add_argument('--corpus', default=CORPUS_DIR)
+    arg_parser.add_argument('--record', action='store_true', help='download TEST_URLS into --corpus (needs network)')
+    arg_parser.add_argument('--slow-pages', help='replay samples saved by slow_pages.SlowPageSampler from this directory')
+    arg_parser.add_argument('--backends', nargs='+', default=None)
+    arg_parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--concurrency', type=int, default=8)
+    arg_parser.add_argument('--output', help='write the JSON report here')
+    arg_parser.add_argument('--baseline', help='JSON report of an earlier commit to compare with')
+    main(arg_parser.parse_args())
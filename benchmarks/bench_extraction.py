@@ -0,0 +1,81 @@
+import argparse
+import logging
+import time
+
+from benchmarks.bench_parser_backends import heavy_page, load_unittest_corpus
+from extraction import NAME_CLASSES, NAME_TAGS, PageCandidates
+from html_backends import make_soup
+from price import has_price, parse_price
+from structured import extract_structured
+
+
+def legacy_extract(soup):
+    # the per-field soup.find() chain ProductParser used before PageCandidates
+    structured = extract_structured(soup)
+    name = structured.get('name', (None,))[0]
+    if name is None:
+        found = None
+        for tag in NAME_TAGS:
+            found = soup.find(tag)
+            if found:
+                break
+        if not found:
+            for cls in NAME_CLASSES:
+                found = soup.find(class_=cls)
+                if found:
+                    break
+        name = found.get_text(strip=True) if found else None
+    price = structured.get('price', (None,))[0]
+    if price is None:
+        tag = soup.find('span', string=has_price)
+        price = parse_price(tag.get_text(strip=True)) if tag else None
+    return name, price
+
+
+def single_pass_extract(soup):
+    candidates = PageCandidates(soup)
+    name = candidates.structured.get('name', (None,))[0]
+    if name is None:
+        tag = candidates.name_tag()
+        name = tag.get_text(strip=True) if tag else None
+    price = candidates.structured.get('price', (None,))[0]
+    if price is None and candidates.price_tag is not None:
+        price = parse_price(candidates.price_tag.get_text(strip=True))
+    return name, price
+
+
+def timed(func, soups, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for soup in soups:
+            func(soup)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(soups)
+
+
+def main(args):
+    logging.disable(logging.WARNING)
+    corpus = [make_soup(html, args.backend) for html in load_unittest_corpus()]
+    mismatches = sum(legacy_extract(soup) != single_pass_extract(soup) for soup in corpus)
+    print(f"unit test corpus: {mismatches}/{len(corpus)} mismatches")
+
+    # a page where the name is only found by class, the legacy worst case
+    pages = {
+        'heavy page': heavy_page(),
+        'class-only name': heavy_page().replace('<h1 class="product-title">', '<p class="product-title">').replace('</h1>', '</p>'),
+    }
+    for label, html in pages.items():
+        soups = [make_soup(html, args.backend) for _ in range(args.pages)]
+        legacy = timed(legacy_extract, soups, args.repeat)
+        single = timed(single_pass_extract, soups, args.repeat)
+        print(f"{label:16} legacy {legacy * 1000:8.1f} ms  single pass {single * 1000:8.1f} ms  x{legacy / single:.1f}")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='python -m benchmarks.bench_extraction')
+    arg_parser.add_argument('--backend', default='html.parser')
+    arg_parser.add_argument('--pages', type=int, default=3)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    main(arg_parser.parse_args())
@@ -0,0 +1,76 @@
+import argparse
+import json
+import random
+import re
+import time
+
+from json_extract import iter_json_objects
+
+# the pattern main_poizion.py used before json_extract
+old_pattern = re.compile(r'\{.*?\}', re.DOTALL)
+
+
+def regex_extract(html):
+    products = []
+    for match in old_pattern.findall(html):
+        try:
+            products.append(json.loads(match))
+        except json.JSONDecodeError:
+            pass
+    return products
+
+
+def scanner_extract(html):
+    return list(iter_json_objects(html))
+
+
+def synthetic_page(products=200, seed=1):
+    # stand-in for a saved catalog page: CSS, inline JS and nested product JSON
+    rng = random.Random(seed)
+    parts = ['<html><head><style>']
+    parts += [f'.item-{i} {{ margin: {i}px; color: #{i:06x}; }}' for i in range(300)]
+    parts.append('</style><script>function init(){ var state = {ready: false}; if (state) { run(); } }</script></head><body>')
+    for i in range(products):
+        product = {
+            'id': i,
+            'title': f'Product {i}',
+            'price': {'amount': round(rng.uniform(10, 500), 2), 'currency': 'RUB'},
+            'sizes': [{'size': size, 'available': rng.random() > 0.3} for size in (40, 41, 42, 43)],
+        }
+        parts.append(f'<div class="card"><script>window.products.push({json.dumps(product)});</script></div>')
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def bench(extract, pages, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = sum(len(extract(page)) for page in pages)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return count, best
+
+
+def main(args):
+    if args.pages:
+        pages = []
+        for path in args.pages:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                pages.append(f.read())
+    else:
+        pages = [synthetic_page(seed=i) for i in range(args.synthetic)]
+
+    size_mb = sum(len(page) for page in pages) / 1e6
+    print(f"{len(pages)} pages, {size_mb:.1f} MB")
+    for name, extract in (('regex', regex_extract), ('scanner', scanner_extract)):
+        count, elapsed = bench(extract, pages, args.repeat)
+        print(f"{name:8} {count:8} objects {elapsed * 1000:9.1f} ms {size_mb / elapsed:8.1f} MB/s")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='python -m benchmarks.bench_json_extract [saved pages...]')
+    arg_parser.add_argument('pages', nargs='*', help='saved HTML pages, a synthetic corpus is used if empty')
+    arg_parser.add_argument('--synthetic', type=int, default=20)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    main(arg_parser.parse_args())
@@ -0,0 +1,51 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from benchmarks.bench_parser_backends import heavy_page
+from ProductParser import parse_html_result, warm_parse_worker
+
+
+def run(executor, pages):
+    urls = [f'http://example.com/p/{i}' for i in range(len(pages))]
+    started = time.perf_counter()
+    results = list(executor.map(parse_html_result, urls, pages))
+    elapsed = time.perf_counter() - started
+    assert all(result['price'] == '€495.00' for result in results)
+    return elapsed
+
+
+def main(args):
+    logging.disable(logging.WARNING)
+    pages = [heavy_page(blocks=args.blocks, seed=i) for i in range(args.pages)]
+    size = sum(len(page) for page in pages) / len(pages) / 1024
+    print(f"{len(pages)} pages, {size:.0f} KiB each, {os.cpu_count()} cpus")
+
+    started = time.perf_counter()
+    for i, page in enumerate(pages):
+        parse_html_result(f'http://example.com/p/{i}', page)
+    elapsed = time.perf_counter() - started
+    print(f"{'inline':14} {len(pages) / elapsed:8.1f} pages/s")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        elapsed = run(executor, pages)
+    print(f"{'threads x4':14} {len(pages) / elapsed:8.1f} pages/s")
+
+    for workers in args.workers:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=warm_parse_worker) as executor:
+            # start and warm every worker before timing
+            list(executor.map(time.sleep, [0.2] * workers))
+            elapsed = run(executor, pages)
+        print(f"{f'processes x{workers}':14} {len(pages) / elapsed:8.1f} pages/s")
+
+
+if __name__ == '__main__':
+    cpus = os.cpu_count() or 1
+    arg_parser = argparse.ArgumentParser(description='python -m benchmarks.bench_parse_pool')
+    arg_parser.add_argument('--pages', type=int, default=64)
+    arg_parser.add_argument('--blocks', type=int, default=2000)
+    arg_parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, cpus} | {n for n in (2, 4, 8, 16) if n < cpus}))
+    main(arg_parser.parse_args())
@@ -0,0 +1,88 @@
+import argparse
+import ast
+import logging
+import random
+import time
+
+from html_backends import available_backends, make_soup
+from ProductParser import ProductParser
+
+
+def load_unittest_corpus(path='UnitTest.py'):
+    # every HTML string literal handed to BeautifulSoup(...) or assigned to
+    # `html` in the unit tests
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    corpus = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and getattr(node.func, 'id', None) == 'BeautifulSoup' and node.args:
+            value = node.args[0]
+        elif isinstance(node, ast.Assign) and any(getattr(target, 'id', None) == 'html' for target in node.targets):
+            value = node.value
+        else:
+            continue
+        if isinstance(value, ast.Constant) and isinstance(value.value, str) and value.value not in corpus:
+            corpus.append(value.value)
+    return corpus
+
+
+def heavy_page(blocks=2000, seed=1):
+    # stand-in for ASOS/Farfetch-sized pages: deep markup and big inline scripts
+    rng = random.Random(seed)
+    parts = ['<html><head><title>Shop</title>']
+    parts += [f'<script>window.__STATE_{i}__ = {{"items": [{",".join(str(rng.random()) for _ in range(50))}]}};</script>' for i in range(50)]
+    parts.append('</head><body><header><nav>')
+    parts += [f'<a class="nav-link" href="/c/{i}">Category {i}</a>' for i in range(200)]
+    parts.append('</nav></header><main><h1 class="product-title">Hermosa Sneakers</h1>')
+    for i in range(blocks):
+        parts.append(f'<div class="tile tile-{i}"><div class="img"><img src="/i/{i}.jpg" alt="item {i}"></div>'
+                     f'<p class="desc">Recommended item {i}</p><em>only today</em></div>')
+    parts.append('<span class="price">€495.00</span></main></body></html>')
+    return ''.join(parts)
+
+
+def extract(html, backend):
+    parser = ProductParser('http://example.com', backend=backend)
+    parser.load_html(html)
+    parser.parse_product_name()
+    parser.parse_product_price()
+    return parser.product_name, parser.product_price
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(args):
+    logging.disable(logging.WARNING)
+    corpus = load_unittest_corpus()
+    pages = [heavy_page(seed=i) for i in range(args.pages)]
+    backends = available_backends()
+    reference = [extract(html, 'html.parser') for html in corpus]
+
+    print(f"unit test corpus: {len(corpus)} documents, heavy pages: {len(pages)} x {len(pages[0]) / 1e6:.1f} MB")
+    for backend in backends:
+        results = [extract(html, backend) for html in corpus]
+        mismatches = [(html, expected, got) for html, expected, got in zip(corpus, reference, results) if expected != got]
+        parse_time = timed(lambda: [make_soup(page, backend) for page in pages], args.repeat)
+        total_time = timed(lambda: [extract(page, backend) for page in pages], args.repeat)
+        print(f"{backend:12} parse {parse_time / len(pages) * 1000:8.1f} ms/page  "
+              f"parse+extract {total_time / len(pages) * 1000:8.1f} ms/page  "
+              f"corpus mismatches {len(mismatches)}/{len(corpus)}")
+        if args.verbose:
+            for html, expected, got in mismatches:
+                print(f"    {html[:70]!r}: {expected} != {got}")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='python -m benchmarks.bench_parser_backends')
+    arg_parser.add_argument('--pages', type=int, default=5)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--verbose', action='store_true', help='print documents whose results differ')
+    main(arg_parser.parse_args())
@@ -0,0 +1,68 @@
+import argparse
+import random
+import re
+import time
+
+from price import has_price, parse_price
+
+
+def legacy_extract(text):
+    # parse_product_price's inline logic before price.py, regexes rebuilt per call
+    currency_symbols = r'[£$€¥₹]'
+    if not re.search(currency_symbols, text):
+        return None
+    price_text = re.sub(r'[^\d\.,£$€¥₹]', '', text)
+    price_text = re.sub(r'\s+', '', price_text)
+    numeric_price = re.search(rf'({currency_symbols}\d{{1,3}}(,\d{{3}})*(\.\d+)?|\d{{1,3}}(,\d{{3}})*(\.\d+)?\s*{currency_symbols})', price_text)
+    return numeric_price.group(0).strip() if numeric_price else None
+
+
+def price_corpus(size, seed=1):
+    rng = random.Random(seed)
+    templates = [
+        '${int},{frac}', '$ {int}', 'Price: ${int}.{frac}', '£{int}.{frac}', '€{int},{frac}',
+        '{int},{frac} €', '{int}.{grp},{frac} €', '{int} {grp},{frac} ₽', '₽{int}', '{int} {grp} руб.',
+        'USD {int}.{frac}', '{int}.{frac} CHF', '¥{int}{grp}', '₹{int},{grp}.{frac}', 'Only ${int}.{frac} today!',
+        'from {int},{frac} EUR', 'SALE -30% €{int}', 'Size {int}', 'N/A', 'Sold out',
+    ]
+    corpus = []
+    for _ in range(size):
+        template = rng.choice(templates)
+        corpus.append(template.format(int=rng.randint(1, 999), grp=f'{rng.randint(0, 999):03d}', frac=f'{rng.randint(0, 99):02d}'))
+    return corpus
+
+
+def span_corpus(size, seed=1):
+    # what has_price mostly sees in PageCandidates: span texts with no price
+    rng = random.Random(seed)
+    texts = ['Add to cart', 'Size guide', 'Free shipping', 'New arrivals', 'Описание', 'Color: Black', 'Sold out',
+             'Size 42', 'Share', '4.8 (120 reviews)']
+    return [rng.choice(texts) for _ in range(size)]
+
+
+def timed(func, corpus, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        found = sum(func(text) is not None for text in corpus)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return found, best
+
+
+def main(args):
+    corpus = price_corpus(args.size)
+    print(f"{len(corpus)} price strings")
+    for name, func in (('legacy', legacy_extract), ('parse_price', parse_price)):
+        found, elapsed = timed(func, corpus, args.repeat)
+        print(f"{name:12} {elapsed * 1000:8.1f} ms  {len(corpus) / elapsed / 1000:8.0f}k strings/s  parsed {found / len(corpus):6.1%}")
+    spans = span_corpus(args.size)
+    _, elapsed = timed(lambda text: has_price(text) or None, spans, args.repeat)
+    print(f"{'has_price':12} {elapsed * 1000:8.1f} ms  {len(spans) / elapsed / 1000:8.0f}k strings/s  on non-price span texts")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='python -m benchmarks.bench_price')
+    arg_parser.add_argument('--size', type=int, default=200000)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    main(arg_parser.parse_args())
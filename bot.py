@@ -1,7 +1,10 @@
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 import logging
-from ProductParser import ProductParser 
+from ProductParser import ProductParser, close_process_executor, get_process_executor
+from fetcher import close_fetcher
+import metrics
+from cache import SingleFlight, TTLCache, canonicalize_url
 import os
 from dotenv import load_dotenv
 
@@ -9,18 +12,38 @@ logging.basicConfig(level=logging.INFO)
 load_dotenv()
 
 class BotHandler:
-    def __init__(self, token, commission_rate=float(os.getenv('COMMISSION_RATE')), additional_fee=float(os.getenv('ADDITIONAL_FEE'))):
+    def __init__(self, token, commission_rate=float(os.getenv('COMMISSION_RATE')), additional_fee=float(os.getenv('ADDITIONAL_FEE')),
+                 cache_ttl=float(os.getenv('CACHE_TTL', 300)), cache_size=int(os.getenv('CACHE_SIZE', 1024)),
+                 parse_processes=int(os.getenv('PARSE_PROCESSES', 0)), metrics_port=int(os.getenv('METRICS_PORT', 0))):
         self.token = token
-        self.application = Application.builder().token(self.token).build()
+        # updates are handled concurrently so one slow shop does not hold up other users
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .concurrent_updates(True)
+            .post_init(self.startup)
+            .post_shutdown(self.shutdown)
+            .build()
+        )
         self.commission_rate = commission_rate
         self.additional_fee = additional_fee
         self.user_data = {}
+        self.result_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.inflight = SingleFlight()
+        # 0 keeps parsing on the in-process thread pool
+        self.parse_executor = get_process_executor(parse_processes) if parse_processes else None
+        # Prometheus text on http://host:METRICS_PORT/metrics, 0 keeps metrics off
+        self.metrics_port = metrics_port
+        self.metrics_runner = None
+        if metrics_port:
+            metrics.enable()
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user = update.message.from_user
         logging.info(f"User {user.id} started the bot.")
         await update.message.reply_text('Send me a product link.')
 
+    @metrics.timed('bot_handle_message_seconds')
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user_message = update.message.text
         user = update.message.from_user
@@ -28,7 +51,7 @@ class BotHandler:
 
         if self.is_valid_url(user_message):
             logging.info(f"Valid URL received: {user_message}")
-            product_info = self.get_product_info(user_message)
+            product_info = await self.get_product_info_async(user_message)
 
             if product_info['price'] != "Price not found":
                 response = f"Product Name: {product_info['name']}\nProduct Price: {product_info['price']}"
@@ -59,8 +82,43 @@ class BotHandler:
             return False
 
     def get_product_info(self, url: str) -> dict:
+        key = canonicalize_url(url)
+        product_info = self.result_cache.get(key)
+        if product_info is None:
+            parser = ProductParser(url)
+            product_info = parser.get_product_info()
+            self.cache_product_info(key, product_info)
+        return dict(product_info)
+
+    async def get_product_info_async(self, url: str) -> dict:
+        key = canonicalize_url(url)
+        product_info = self.result_cache.get(key)
+        metrics.inc('parser_cache_requests_total', cache='result', result='hit' if product_info is not None else 'miss')
+        if product_info is None:
+            product_info = await self.inflight.do(key, lambda: self.fetch_product_info(url, key))
+        return dict(product_info)
+
+    async def fetch_product_info(self, url: str, key: str) -> dict:
         parser = ProductParser(url)
-        return parser.get_product_info()
+        product_info = await parser.get_product_info_async(executor=self.parse_executor)
+        self.cache_product_info(key, product_info)
+        return product_info
+
+    def cache_product_info(self, key: str, product_info: dict) -> None:
+        # failed lookups are not cached, the shop may just have been slow
+        if product_info['price'] != "Price not found":
+            self.result_cache.set(key, dict(product_info))
+
+    async def startup(self, application: Application) -> None:
+        if self.metrics_port:
+            self.metrics_runner = await metrics.start_http_server(self.metrics_port)
+
+    async def shutdown(self, application: Application) -> None:
+        await close_fetcher()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        if self.parse_executor is not None:
+            close_process_executor()
 
     def run(self):
         self.application.add_handler(CommandHandler("start", self.start))
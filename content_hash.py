@@ -0,0 +1,25 @@
+import hashlib
+import re
+
+# per-request noise that changes the bytes of an otherwise identical page
+VOLATILE_PATTERNS = [
+    re.compile(rb'nonce="[^"]*"'),
+    re.compile(rb'<meta[^>]+name="csrf-(?:token|param)"[^>]*>', re.IGNORECASE),
+    re.compile(rb'<input[^>]+name="(?:authenticity_token|csrf_token|_token|csrfmiddlewaretoken)"[^>]*>', re.IGNORECASE),
+    re.compile(rb'data-(?:request|trace|session)-id="[^"]*"'),
+    re.compile(rb'"(?:csrfToken|requestId|traceId|serverTime|timestamp)"\s*:\s*(?:"[^"]*"|\d+)'),
+]
+
+
+def normalize_html(html):
+    data = html.encode('utf-8', 'surrogatepass') if isinstance(html, str) else html
+    for pattern in VOLATILE_PATTERNS:
+        data = pattern.sub(b'', data)
+    return data
+
+
+def content_key(html, profile=None):
+    # the same page can be read differently by a site profile, so the
+    # profile domain is part of the key
+    digest = hashlib.blake2b(normalize_html(html), digest_size=16).hexdigest()
+    return f'{profile.domain}:{digest}' if profile is not None else digest
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from fetcher import AsyncFetcher
+from ratelimit import CircuitOpenError, HostRateLimiter
+
+
+class PageCrawler:
+    def __init__(self, page_url, fetcher=None, concurrency=8, rate=5, retries=3, backoff=0.5, timeout=30, executor=None,
+                 circuit_wait=300):
+        # page_url is a template like 'https://example.com/page/{page}/'
+        self.page_url = page_url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # seconds a page may wait for the shop's circuit breaker to close
+        # before it counts as failed
+        self.circuit_wait = circuit_wait
+        self.fetcher = fetcher or AsyncFetcher(limit_per_host=concurrency, rate_limiter=HostRateLimiter(rate, burst=concurrency))
+        self.failed_pages = []
+        # optional process pool for extract(); it must then be a picklable
+        # module-level function
+        self.executor = executor
+        # links may be absolute or relative, so only the path part is matched
+        self.pagination_pattern = re.compile(re.escape(urlsplit(page_url).path).replace(r'\{page\}', r'(\d+)'))
+
+    def url_for(self, page_num):
+        return self.page_url.format(page=page_num)
+
+    async def fetch(self, page_num):
+        return await self.fetcher.fetch_text(self.url_for(page_num), timeout=self.timeout,
+                                             retries=self.retries, backoff=self.backoff)
+
+    async def page_exists(self, page_num):
+        try:
+            await self.fetch(page_num)
+            return True
+        except aiohttp.ClientResponseError as err:
+            if err.status == 404:
+                return False
+            raise
+
+    async def discover_last_page(self):
+        # pagination links on the first page give a lower bound, then gallop
+        # and binary search on 404s for the real end
+        html = await self.fetch(1)
+        linked = [int(num) for num in self.pagination_pattern.findall(html)]
+        low = max(linked, default=1)
+        if low > 1 and not await self.page_exists(low):
+            low = 1
+        high = low * 2
+        while await self.page_exists(high):
+            low, high = high, high * 2
+        while high - low > 1:
+            middle = (low + high) // 2
+            if await self.page_exists(middle):
+                low = middle
+            else:
+                high = middle
+        logging.info(f"Last page of {self.page_url} is {low}.")
+        return low
+
+    async def crawl(self, extract, pages=None):
+        # yields (page_num, items) as pages finish, in completion order
+        if pages is None:
+            pages = range(1, await self.discover_last_page() + 1)
+        queue = asyncio.Queue()
+        for page_num in pages:
+            queue.put_nowait(page_num)
+        results = asyncio.Queue()
+        total = queue.qsize()
+        waited = {}
+
+        async def worker():
+            while not queue.empty():
+                page_num = queue.get_nowait()
+                try:
+                    items = await self.extract(extract, await self.fetch(page_num))
+                except CircuitOpenError as err:
+                    # the shop is down for now: wait it out and put the page
+                    # back instead of failing everything still queued; polls
+                    # at least every second, the half-open trial may close
+                    # the breaker well before err.retry_in
+                    delay = min(err.retry_in, 1.0)
+                    if waited.get(page_num, 0) + delay <= self.circuit_wait:
+                        waited[page_num] = waited.get(page_num, 0) + delay
+                        await asyncio.sleep(delay)
+                        queue.put_nowait(page_num)
+                        continue
+                    logging.error(f"Page {page_num} failed: {err!r}")
+                    self.failed_pages.append(page_num)
+                    items = None
+                except Exception as err:
+                    logging.error(f"Page {page_num} failed: {err!r}")
+                    self.failed_pages.append(page_num)
+                    items = None
+                await results.put((page_num, items))
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, total))]
+        try:
+            for _ in range(total):
+                page_num, items = await results.get()
+                if items is not None:
+                    yield page_num, items
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def extract(self, extract, html):
+        if self.executor is None:
+            return extract(html)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, extract, html)
+
+    async def close(self):
+        await self.fetcher.close()
+
+
+class CrawlCheckpoint:
+    def __init__(self, path, completed_pages=(), output_offset=0, last_page=None):
+        self.path = path
+        self.completed_pages = set(completed_pages)
+        self.output_offset = output_offset
+        self.last_page = last_page
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+        return cls(path, state['completed_pages'], state['output_offset'], state.get('last_page'))
+
+    def pending(self, pages):
+        return [page_num for page_num in pages if page_num not in self.completed_pages]
+
+    def mark_done(self, page_num, output_offset):
+        # call only after the page's output is flushed, so the offset is durable
+        self.completed_pages.add(page_num)
+        self.output_offset = output_offset
+        self.save()
+
+    def save(self):
+        state = {
+            'completed_pages': sorted(self.completed_pages),
+            'output_offset': self.output_offset,
+            'last_page': self.last_page,
+        }
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,41 @@
+from bs4.element import Tag
+
+from price import has_price
+from structured import StructuredCollector
+
+NAME_TAGS = ('h1', 'h2', 'h3', 'title', 'div', 'span')
+NAME_CLASSES = ('product-title', 'product-name', 'name', 'title')
+
+
+class PageCandidates:
+    # Everything the name/price rules look at, gathered in one walk over the
+    # tree instead of one soup.find() per tag, class and field. Picks follow
+    # the old order: structured data, then first h1, h2, ... then classes.
+    def __init__(self, soup):
+        self.tags = {}
+        self.classes = {}
+        self.price_tag = None
+        collector = StructuredCollector()
+        for node in soup.descendants:
+            if not isinstance(node, Tag):
+                continue
+            name = node.name
+            if name in NAME_TAGS and name not in self.tags:
+                self.tags[name] = node
+            for cls in node.get('class') or ():
+                if cls in NAME_CLASSES and cls not in self.classes:
+                    self.classes[cls] = node
+            if name == 'span' and self.price_tag is None and has_price(node.string):
+                self.price_tag = node
+            elif name == 'script' or name == 'meta':
+                collector.add_tag(node)
+        self.structured = collector.result()
+
+    def name_tag(self):
+        for tag in NAME_TAGS:
+            if tag in self.tags:
+                return self.tags[tag]
+        for cls in NAME_CLASSES:
+            if cls in self.classes:
+                return self.classes[cls]
+        return None
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+
+import metrics
+from ratelimit import error_response, get_host_limiter
+
+
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+def trace_config():
+    # DNS and connect (TCP + TLS) time of new connections, reused
+    # keep-alive connections do not show up here
+    def on_start(phase):
+        async def handler(session, context, params):
+            setattr(context, f'{phase}_started', asyncio.get_running_loop().time())
+        return handler
+
+    def on_end(phase):
+        async def handler(session, context, params):
+            elapsed = asyncio.get_running_loop().time() - getattr(context, f'{phase}_started')
+            metrics.observe('fetch_phase_seconds', elapsed, phase=phase)
+        return handler
+
+    config = aiohttp.TraceConfig()
+    config.on_dns_resolvehost_start.append(on_start('dns'))
+    config.on_dns_resolvehost_end.append(on_end('dns'))
+    config.on_connection_create_start.append(on_start('connect'))
+    config.on_connection_create_end.append(on_end('connect'))
+    return config
+
+
+def is_transient_error(err):
+    # aiohttp and requests errors alike
+    status, _ = error_response(err)
+    if status is not None:
+        return status in TRANSIENT_STATUSES
+    return isinstance(err, (aiohttp.ClientConnectionError, asyncio.TimeoutError,
+                            requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class RetryPolicy:
+    # Retries transient errors only, with "full jitter" exponential backoff:
+    # the n-th wait is random in [0, min(max_backoff, backoff * 2 ** n)], so
+    # clients that failed together do not come back together. deadline caps
+    # the whole thing (attempts and waits) in seconds; each attempt's timeout
+    # is cut to what is left of it.
+    def __init__(self, retries=2, backoff=0.25, max_backoff=8, deadline=None, jitter=True, rng=random.random):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.jitter = jitter
+        self.rng = rng
+
+    def delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay * self.rng() if self.jitter else delay
+
+    def next_delay(self, err, attempt, elapsed):
+        # seconds to wait before the next attempt, or None to give up
+        if attempt >= self.retries or not is_transient_error(err):
+            return None
+        delay = self.delay(attempt)
+        if self.deadline is not None and elapsed + delay >= self.deadline:
+            return None
+        return delay
+
+    def attempt_timeout(self, timeout, elapsed):
+        if self.deadline is None:
+            return timeout
+        return max(0.0, min(timeout, self.deadline - elapsed))
+
+    def log_retry(self, url, err, delay, attempt):
+        metrics.inc('fetch_retries_total')
+        logging.warning(f"Retrying {url} in {delay:.2f}s after {err!r} (attempt {attempt}/{self.retries}).")
+
+    async def call(self, attempt_once, url, timeout=15):
+        # attempt_once(timeout) is awaited until it succeeds or the policy gives up
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        attempt = 0
+        while True:
+            try:
+                return await attempt_once(self.attempt_timeout(timeout, loop.time() - started))
+            except Exception as err:
+                delay = self.next_delay(err, attempt, loop.time() - started)
+                if delay is None:
+                    raise
+                attempt += 1
+                self.log_retry(url, err, delay, attempt)
+                await asyncio.sleep(delay)
+
+    def call_sync(self, attempt_once, url, timeout=15):
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                return attempt_once(self.attempt_timeout(timeout, time.monotonic() - started))
+            except Exception as err:
+                delay = self.next_delay(err, attempt, time.monotonic() - started)
+                if delay is None:
+                    raise
+                attempt += 1
+                self.log_retry(url, err, delay, attempt)
+                time.sleep(delay)
+
+
+class HostLatency:
+    # recent successful request times per host, for the hedging threshold
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = {}
+
+    def record(self, host, seconds):
+        samples = self.samples.get(host)
+        if samples is None:
+            samples = self.samples[host] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def percentile(self, host, q=95):
+        # None until the host has min_samples answers
+        samples = self.samples.get(host)
+        if samples is None or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, len(ordered) * q // 100)]
+
+
+class AsyncFetcher:
+    # hedge=True: when a page has not answered within the host's p95, a
+    # second request is sent and the first answer wins; at most hedge_ratio
+    # of requests are hedged, so a slow host does not get double the load
+    def __init__(self, limit=100, limit_per_host=8, keepalive_timeout=30, dns_cache_ttl=300, rate_limiter=None,
+                 hedge=False, hedge_ratio=0.1, latency=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.rate_limiter = rate_limiter
+        self.hedge = hedge
+        self.hedge_ratio = hedge_ratio
+        self.latency = latency if latency is not None else HostLatency()
+        self.hedgeable = 0
+        self.hedged = 0
+        self._session = None
+        self._loop = None
+
+    async def get_session(self):
+        # aiohttp sessions are bound to the loop they were created on
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            if self._session is not None and not self._session.closed and not self._loop.is_closed():
+                logging.warning("Dropping aiohttp session created on another event loop.")
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            trace_configs = [trace_config()] if metrics.enabled() else None
+            self._session = aiohttp.ClientSession(connector=connector, trace_configs=trace_configs)
+            self._loop = loop
+        return self._session
+
+    async def fetch_text(self, url, headers=None, timeout=15, retries=0, backoff=0.5, policy=None):
+        if policy is None:
+            policy = RetryPolicy(retries=retries, backoff=backoff)
+        return await policy.call(lambda attempt_timeout: self.fetch_text_once(url, headers, attempt_timeout), url, timeout)
+
+    async def fetch_text_once(self, url, headers=None, timeout=15):
+        async def read(response):
+            return await response.text()
+        if self.hedge:
+            return await self.hedged_request(url, read, headers, timeout)
+        return await self.request(url, read, headers, timeout)
+
+    async def hedged_request(self, url, read, headers=None, timeout=15):
+        hedge_after = self.latency.percentile(urlsplit(url).hostname)
+        self.hedgeable += 1
+        if hedge_after is None or self.hedged >= self.hedge_ratio * self.hedgeable:
+            return await self.request(url, read, headers, timeout)
+        first = asyncio.ensure_future(self.request(url, read, headers, timeout))
+        pending = {first}
+        try:
+            # cancelling the caller at any point below cancels both requests
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if done:
+                return first.result()
+            self.hedged += 1
+            metrics.inc('fetch_hedged_total')
+            pending.add(asyncio.ensure_future(self.request(url, read, headers, max(0.0, timeout - hedge_after))))
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            metrics.inc('fetch_hedge_won_total')
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def fetch_conditional(self, url, headers=None, timeout=15):
+        # (status, text, response headers); a 304 has no body and text is None
+        async def read(response):
+            text = None if response.status == 304 else await response.text()
+            return response.status, text, response.headers
+        return await self.request(url, read, headers, timeout)
+
+    async def fetch_json(self, url, headers=None, timeout=15):
+        async def read(response):
+            cookies = {name: morsel.value for name, morsel in response.cookies.items()}
+            return await response.json(content_type=None), cookies
+        return await self.request(url, read, headers, timeout)
+
+    async def fetch_stream(self, url, consume, headers=None, timeout=15, chunk_size=16384):
+        # consume(chunk, encoding) returns True to stop; leaving the response
+        # early closes the connection instead of reading the rest of the body
+        async def read(response):
+            async for chunk in response.content.iter_chunked(chunk_size):
+                if consume(chunk, response.charset):
+                    break
+        return await self.request(url, read, headers, timeout)
+
+    async def request(self, url, read, headers=None, timeout=15):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(url)
+        session = await self.get_session()
+        client_timeout = aiohttp.ClientTimeout(total=timeout)
+        started = time.perf_counter()
+        try:
+            with metrics.timer('parser_stage_seconds', stage='fetch'):
+                async with session.get(url, headers=headers, timeout=client_timeout) as response:
+                    response.raise_for_status()
+                    result = await read(response)
+                    metrics.inc('fetch_bytes_total', response.content.total_bytes)
+        except Exception as err:
+            if self.rate_limiter is not None:
+                self.rate_limiter.record_error(url, err)
+            raise
+        self.latency.record(urlsplit(url).hostname, time.perf_counter() - started)
+        if self.rate_limiter is not None:
+            self.rate_limiter.record_response(url, response.status, response.headers)
+        return result
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+
+_default_fetcher = None
+
+
+def get_fetcher():
+    global _default_fetcher
+    if _default_fetcher is None:
+        _default_fetcher = AsyncFetcher(rate_limiter=get_host_limiter(), hedge=os.getenv('HEDGE_REQUESTS') == '1')
+    return _default_fetcher
+
+
+async def close_fetcher():
+    if _default_fetcher is not None:
+        await _default_fetcher.close()
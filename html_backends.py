@@ -0,0 +1,43 @@
+import importlib.util
+import logging
+import os
+from functools import lru_cache
+
+from bs4 import BeautifulSoup
+
+# BeautifulSoup tree builders; lxml is C-backed and builds the tree several
+# times faster than the pure-Python html.parser on heavy pages
+BACKEND_MODULES = {'html.parser': None, 'lxml': 'lxml', 'html5lib': 'html5lib'}
+FALLBACK_BACKEND = 'html.parser'
+
+default_backend = os.getenv('PARSER_BACKEND', FALLBACK_BACKEND)
+
+
+def is_available(name):
+    if name not in BACKEND_MODULES:
+        return False
+    module = BACKEND_MODULES[name]
+    return module is None or importlib.util.find_spec(module) is not None
+
+
+def available_backends():
+    return [name for name in BACKEND_MODULES if is_available(name)]
+
+
+@lru_cache(maxsize=None)
+def resolve_backend(name):
+    if is_available(name):
+        return name
+    logging.warning(f"HTML parser backend {name!r} is not installed, using {FALLBACK_BACKEND!r}.")
+    return FALLBACK_BACKEND
+
+
+def set_default_backend(name):
+    global default_backend
+    if not is_available(name):
+        raise ValueError(f"HTML parser backend {name!r} is not available, choose from {available_backends()}")
+    default_backend = name
+
+
+def make_soup(html, backend=None):
+    return BeautifulSoup(html, resolve_backend(backend or default_backend))
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from decimal import Decimal
+
+from cache import canonicalize_url
+from price import Price
+
+
+def dump_result(result):
+    price = result.get('price_value')
+    return {**result, 'price_value': [str(price.amount), price.currency, price.text] if price else None}
+
+
+def load_result(data):
+    price = data.get('price_value')
+    return {**data, 'price_value': Price(Decimal(price[0]), price[1], price[2]) if price else None}
+
+
+class HTTPCache:
+    # Pages on disk with their ETag / Last-Modified, for conditional requests.
+    # Each url has <sha1>.html (body) and <sha1>.json (validators and the
+    # parse result of that body). Least recently used entries are dropped
+    # once the bodies take more than max_bytes.
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.revalidated = 0
+        self._index = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url, suffix):
+        key = hashlib.sha1(canonicalize_url(url).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, url):
+        try:
+            with open(self.path(url, '.json'), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('result') is not None:
+            entry['result'] = load_result(entry['result'])
+        return entry
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def body(self, url):
+        try:
+            with open(self.path(url, '.html'), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def store(self, url, body, etag=None, last_modified=None):
+        if not etag and not last_modified:
+            # nothing to revalidate with, a stored copy would never be used
+            self.remove(url)
+            return
+        self.write(self.path(url, '.html'), body)
+        self.write_entry(url, {'url': url, 'etag': etag, 'last_modified': last_modified, 'result': None})
+        with self._lock:
+            self.index()[self.path(url, '')] = [len(body.encode('utf-8')), time.time()]
+        self.evict()
+
+    def store_result(self, url, result):
+        entry = self.get(url)
+        if entry is not None:
+            entry['result'] = result
+            self.write_entry(url, entry)
+
+    def touch(self, url):
+        # a 304 counts as a use for eviction
+        self.revalidated += 1
+        try:
+            os.utime(self.path(url, '.json'))
+        except OSError:
+            return
+        with self._lock:
+            item = self.index().get(self.path(url, ''))
+            if item is not None:
+                item[1] = time.time()
+
+    def remove(self, url):
+        with self._lock:
+            self.index().pop(self.path(url, ''), None)
+        self.remove_files(self.path(url, ''))
+
+    def remove_files(self, base):
+        for suffix in ('.json', '.html'):
+            try:
+                os.remove(base + suffix)
+            except FileNotFoundError:
+                pass
+
+    def write_entry(self, url, entry):
+        if entry.get('result') is not None:
+            entry = {**entry, 'result': dump_result(entry['result'])}
+        self.write(self.path(url, '.json'), json.dumps(entry))
+
+    def write(self, path, text):
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def index(self):
+        # base path -> [body size, last use], built from the directory once
+        if self._index is None:
+            self._index = {}
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    base = os.path.join(self.directory, name[:-len('.json')])
+                    try:
+                        self._index[base] = [os.path.getsize(base + '.html'), os.path.getmtime(base + '.json')]
+                    except OSError:
+                        continue
+        return self._index
+
+    def size(self):
+        with self._lock:
+            return sum(size for size, _ in self.index().values())
+
+    def evict(self):
+        with self._lock:
+            index = self.index()
+            total = sum(size for size, _ in index.values())
+            if total <= self.max_bytes:
+                return
+            for base, (size, _) in sorted(index.items(), key=lambda item: item[1][1]):
+                if total <= self.max_bytes:
+                    break
+                del index[base]
+                self.remove_files(base)
+                total -= size
@@ -0,0 +1,47 @@
+import json
+import re
+
+_decoder = json.JSONDecoder()
+# a JSON object in a page starts with '{' followed by a quoted key, which
+# skips CSS rules and most JS blocks without trying to decode them
+_object_start = re.compile(r'\{\s*"')
+# double-quoted strings (their braces do not count) and braces
+_block_tokens = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}]')
+
+
+def block_end(text, index):
+    # end of the brace block opening at index, or None if it never closes;
+    # used to step over a block raw_decode rejected (JS, not JSON) without
+    # yielding the objects nested inside it
+    depth = 0
+    for token in _block_tokens.finditer(text, index):
+        if token.group() == '{':
+            depth += 1
+        elif token.group() == '}':
+            depth -= 1
+            if depth == 0:
+                return token.end()
+    return None
+
+
+def iter_json_objects(text, start=None):
+    # complete top-level objects only, in one pass over the text: raw_decode
+    # balances braces and strings for us, after a hit we jump past the whole
+    # object and after a miss past the whole broken block, so nested objects
+    # are never decoded on their own
+    pattern = _object_start if start is None else re.compile(re.escape(start))
+    pos = 0
+    while True:
+        match = pattern.search(text, pos)
+        if match is None:
+            return
+        index = match.start()
+        try:
+            obj, end = _decoder.raw_decode(text, index)
+        except json.JSONDecodeError:
+            end = block_end(text, index)
+            pos = end if end is not None else index + 1
+            continue
+        if isinstance(obj, dict):
+            yield obj
+        pos = end
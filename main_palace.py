@@ -1,30 +1,19 @@
 import requests
-import json
-import re
+
+from json_extract import iter_json_objects
+from ndjson_sink import NDJSONWriter
 
 link = 'https://shop.palaceskateboards.com/'
 response = requests.get(link).text
 
-# Используем более точное регулярное выражение для поиска полных JSON-объектов
-pattern = re.compile(r'\{"availableForSale".*?"compareAtPrice":null\}\]\}\}', re.DOTALL)
-
-matches = pattern.findall(response)
-
-if matches:
-    items = []
-
-    for match in matches:
-        try:
-            # Загружаем каждый JSON блок отдельно
-            product = json.loads(match)
-            items.append(product)
-        except json.JSONDecodeError as e:
-            print(f"Ошибка при декодировании JSON: {e}")
+# Каждый товар в странице - JSON-объект, который начинается с ключа availableForSale
+product_start = '{"availableForSale"'
 
-    # Сохраняем данные в файл JSON
-    with open('palace_products.json', 'w') as f:
-        json.dump(items, f, indent=4)
+# Товары пишутся в файл по одному JSON-объекту на строку сразу по мере разбора
+with NDJSONWriter('palace_products.ndjson') as writer:
+    writer.write_many(iter_json_objects(response, start=product_start))
 
-    print("Данные успешно сохранены в 'palace_products.json'.")
+if writer.count:
+    print(f"Данные успешно сохранены в 'palace_products.ndjson' ({writer.count} товаров).")
 else:
     print("Не удалось найти данные о товарах на странице.")
@@ -1,36 +1,74 @@
-import requests
-import json
-import re
+import argparse
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from crawler import CrawlCheckpoint, PageCrawler
+from json_extract import iter_json_objects
+from ndjson_sink import NDJSONWriter
 
 # Base URL for the Poizon Express website
-base_url = 'https://poizon.poizonexpress.ru/page/'
-
-# Initialize an empty list to store products
-all_products = []
-
-# Iterate through the pages (assuming there are 317 pages)
-for page_num in range(1, 318):
-    url = f'{base_url}{page_num}/'
-    response = requests.get(url).text
-    
-    # Adjust this pattern according to the site's structure
-    pattern = re.compile(r'\{.*?\}', re.DOTALL)
-
-    matches = pattern.findall(response)
-
-    if matches:
-        for match in matches:
-            try:
-                # Attempt to load each JSON block
-                product = json.loads(match)
-                all_products.append(product)
-            except json.JSONDecodeError as e:
-                print(f"Ошибка при декодировании JSON на странице {page_num}: {e}")
-    else:
-        print(f"Не удалось найти данные на странице {page_num}.")
-
-# Save the collected products to a JSON file
-with open('poizon_products.json', 'w') as f:
-    json.dump(all_products, f, indent=4)
-
-print("Данные успешно сохранены в 'poizon_products.json'.")
+page_url = 'https://poizon.poizonexpress.ru/page/{page}/'
+
+output_path = 'poizon_products.ndjson'
+checkpoint_path = 'poizon_checkpoint.json'
+
+
+def extract_products(html):
+    # complete top-level JSON objects embedded in the page
+    return list(iter_json_objects(html))
+
+
+async def main(args):
+    executor = ProcessPoolExecutor(args.processes, mp_context=multiprocessing.get_context('spawn')) if args.processes else None
+    crawler = PageCrawler(page_url, concurrency=args.concurrency, rate=args.rate, retries=args.retries, executor=executor)
+    checkpoint = CrawlCheckpoint.load(checkpoint_path) if args.resume else CrawlCheckpoint(checkpoint_path)
+    if args.resume:
+        output_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+        if output_size < checkpoint.output_offset:
+            # the output was replaced or cut short, its pages are not on disk
+            print(f"Файл '{output_path}' короче, чем записано в {checkpoint_path}, загружаем всё заново.")
+            checkpoint = CrawlCheckpoint(checkpoint_path, last_page=checkpoint.last_page)
+        # drop whatever was written after the last saved checkpoint
+        with open(output_path, 'a') as f:
+            f.truncate(checkpoint.output_offset)
+        print(f"Продолжаем: уже загружено {len(checkpoint.completed_pages)} страниц.")
+
+    # products go to disk page by page, one JSON object per line
+    try:
+        checkpoint.last_page = args.last_page or checkpoint.last_page or await crawler.discover_last_page()
+        pages = checkpoint.pending(range(1, checkpoint.last_page + 1))
+        # a fresh run empties the output, so the old checkpoint must go first
+        checkpoint.save()
+        with NDJSONWriter(output_path, mode='a' if args.resume else 'w') as writer:
+            async for page_num, products in crawler.crawl(extract_products, pages):
+                if not products:
+                    print(f"Не удалось найти данные на странице {page_num}.")
+                writer.write_many(products)
+                writer.flush()
+                checkpoint.mark_done(page_num, writer.offset)
+    finally:
+        await crawler.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    if crawler.failed_pages:
+        print(f"Не удалось загрузить страницы: {sorted(crawler.failed_pages)}, запустите с --resume")
+
+    print(f"Сохранено {writer.count} товаров в '{output_path}'.")
+
+
+def parse_args(argv=None):
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--concurrency', type=int, default=8)
+    arg_parser.add_argument('--rate', type=float, default=5, help='requests per second to the shop')
+    arg_parser.add_argument('--retries', type=int, default=3)
+    arg_parser.add_argument('--last-page', type=int, default=None, help='skip auto-discovery of the last page')
+    arg_parser.add_argument('--processes', type=int, default=0, help='parse pages in this many worker processes')
+    arg_parser.add_argument('--resume', action='store_true', help=f'skip pages already recorded in {checkpoint_path}')
+    return arg_parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,191 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+
+from aiohttp import web
+
+# Stage timings and counters for the fetch -> parse -> extract path.
+# Off by default: until enable() is called inc/observe/timer return right
+# away. A sink is anything with inc(name, value, labels) and
+# observe(name, value, labels); Registry keeps the numbers in memory and
+# renders them in the Prometheus text format.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_sink = None
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value, labels):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f'# TYPE {name} counter')
+                lines.append(f'{name}{format_labels(labels)} {value}')
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f'# TYPE {name} histogram')
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels) + '}'
+
+
+class Timer:
+    __slots__ = ('name', 'labels', 'started')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        sink = _sink
+        if sink is not None:
+            sink.observe(self.name, time.perf_counter() - self.started, self.labels)
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return None
+
+
+NULL_TIMER = NullTimer()
+
+
+def enable(sink=None):
+    global _sink
+    _sink = sink if sink is not None else Registry()
+    return _sink
+
+
+def disable():
+    global _sink
+    _sink = None
+
+
+def enabled():
+    return _sink is not None
+
+
+def get_sink():
+    return _sink
+
+
+def inc(name, value=1, **labels):
+    sink = _sink
+    if sink is not None:
+        sink.inc(name, value, tuple(sorted(labels.items())))
+
+
+def observe(name, value, **labels):
+    sink = _sink
+    if sink is not None:
+        sink.observe(name, value, tuple(sorted(labels.items())))
+
+
+def timer(name, **labels):
+    if _sink is None:
+        return NULL_TIMER
+    return Timer(name, tuple(sorted(labels.items())))
+
+
+def timed(name, **labels):
+    # decorator form of timer() for whole functions
+    labels = tuple(sorted(labels.items()))
+
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _sink is None:
+                    return await func(*args, **kwargs)
+                with Timer(name, labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return func(*args, **kwargs)
+            with Timer(name, labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+async def start_http_server(port, host='0.0.0.0', path='/metrics'):
+    # Prometheus scrape endpoint on the running loop; returns the runner to clean up
+    async def handler(request):
+        sink = _sink
+        text = sink.render() if isinstance(sink, Registry) else ''
+        return web.Response(text=text, content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get(path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
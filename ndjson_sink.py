@@ -0,0 +1,53 @@
+import json
+import os
+import time
+
+
+class NDJSONWriter:
+    def __init__(self, path, mode='w', flush_every=100, flush_interval=5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.count = 0
+        self.file = open(path, mode, encoding='utf-8')
+        self.offset = self.file.tell()
+        self._pending = 0
+        self._flushed_at = time.monotonic()
+
+    def write(self, item):
+        line = json.dumps(item, ensure_ascii=False) + '\n'
+        self.file.write(line)
+        self.offset += len(line.encode('utf-8'))
+        self.count += 1
+        self._pending += 1
+        if self._pending >= self.flush_every or time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def write_many(self, items):
+        for item in items:
+            self.write(item)
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._pending = 0
+        self._flushed_at = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_ndjson(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
@@ -0,0 +1,127 @@
+import re
+from decimal import Decimal, InvalidOperation
+from typing import NamedTuple, Optional
+
+# everything here is compiled once at import; parse_price() is on the hot path
+# of every page and every candidate span
+
+SYMBOLS = {
+    '$': 'USD', '£': 'GBP', '€': 'EUR', '¥': 'JPY', '₹': 'INR', '₽': 'RUB', '₩': 'KRW', '₺': 'TRY',
+    '₴': 'UAH', '₸': 'KZT', '₪': 'ILS', '฿': 'THB', '₫': 'VND', '₱': 'PHP', '₦': 'NGN',
+    'руб.': 'RUB', 'руб': 'RUB', 'рублей': 'RUB', 'рубля': 'RUB', 'рубль': 'RUB', 'zł': 'PLN',
+}
+SYMBOL_FOR_CODE = {'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥', 'CNY': '¥', 'INR': '₹', 'RUB': '₽'}
+CODES = (
+    'USD', 'EUR', 'GBP', 'JPY', 'CNY', 'RUB', 'INR', 'CHF', 'CAD', 'AUD', 'NZD', 'SEK', 'NOK', 'DKK',
+    'PLN', 'CZK', 'HUF', 'KRW', 'HKD', 'SGD', 'TRY', 'UAH', 'KZT', 'BYN', 'AED', 'ILS', 'BRL', 'MXN',
+    'ZAR', 'THB',
+)
+
+CODE_SET = frozenset(CODES)
+CURRENCY_CODES = {**{code: code for code in CODES}, **SYMBOLS}
+
+_single_symbols = ''.join(re.escape(symbol) for symbol in SYMBOLS if len(symbol) == 1)
+# a word symbol must end the word, 'руб' is not a price in 'рубашка'
+_word_symbols = '|'.join(re.escape(symbol) for symbol in sorted(SYMBOLS, key=len, reverse=True) if len(symbol) > 1)
+_word_symbols = rf'(?:{_word_symbols})(?!\w)'
+_code = rf'(?<![A-Za-z])(?:{"|".join(CODES)})(?![A-Za-z])'
+_currency = rf'(?:[{_single_symbols}]|{_word_symbols}|{_code})'
+# 1,234.56 / 1.234,56 / 1 234,56 / 1'234.56 / 1234.5
+_number = r"(?:\d{1,3}(?:[ \u00a0\u202f',.]\d{3})+|\d+)(?:[.,]\d{1,2})?(?!\d)"
+
+# the leading lookahead lets the scanner skip positions that cannot start a price
+_first_chars = ''.join(re.escape(char) for char in sorted({symbol[0] for symbol in SYMBOLS} | {code[0] for code in CODES}))
+
+price_pattern = re.compile(
+    rf'(?=[-−\d{_first_chars}])(?P<sign>[-−])?(?:(?P<prefix>{_currency})\s*(?P<number>{_number})'
+    rf'|(?P<suffix_number>{_number})(?P<space>\s*)(?P<suffix>{_currency}))'
+)
+group_separators = str.maketrans('', '', " \u00a0\u202f'")
+# most candidate spans have no digit at all, this C scan rejects them
+# about 2.5x faster than the full pattern
+has_digit = re.compile(r'\d').search
+
+
+class Price(NamedTuple):
+    amount: Decimal
+    currency: Optional[str]
+    text: str
+
+    def __str__(self):
+        return self.text
+
+
+def parse_amount(number):
+    # the last '.' or ',' is the decimal point when both appear; a lone
+    # separator followed by exactly three digits is a thousands separator
+    if number.isdigit():
+        return Decimal(number)
+    digits = number.translate(group_separators)
+    last_dot, last_comma = digits.rfind('.'), digits.rfind(',')
+    if last_dot >= 0 and last_comma >= 0:
+        decimal_sep = '.' if last_dot > last_comma else ','
+    elif last_dot >= 0 or last_comma >= 0:
+        sep = '.' if last_dot >= 0 else ','
+        fraction = digits.rpartition(sep)[2]
+        decimal_sep = sep if digits.count(sep) == 1 and len(fraction) != 3 else None
+    else:
+        decimal_sep = None
+    if decimal_sep:
+        integer, _, fraction = digits.rpartition(decimal_sep)
+        digits = f"{integer.replace('.', '').replace(',', '')}.{fraction}"
+    else:
+        digits = digits.replace('.', '').replace(',', '')
+    return Decimal(digits)
+
+
+def parse_price(text):
+    if not text or has_digit(text) is None:
+        return None
+    match = price_pattern.search(text)
+    if match is None:
+        return None
+    sign, prefix, number, suffix_number, space, suffix = match.groups()
+    if prefix:
+        currency = prefix
+        display = f'{prefix} {number}' if prefix in CODE_SET else f'{prefix}{number}'
+    else:
+        currency, number = suffix, suffix_number
+        display = f'{number} {suffix}' if space or suffix in CODE_SET else f'{number}{suffix}'
+    amount = parse_amount(number)
+    if sign:
+        return Price(-amount, CURRENCY_CODES.get(currency) or currency.upper(), sign + display)
+    return Price(amount, CURRENCY_CODES.get(currency) or currency.upper(), display)
+
+
+def has_price(text):
+    return bool(text) and has_digit(text) is not None and price_pattern.search(text) is not None
+
+
+def make_price(amount, currency=None):
+    # prices from json-ld, meta tags and shop APIs come in machine format;
+    # anything but a number or a string (true, {}, [...]) is not a price
+    if isinstance(amount, bool) or not isinstance(amount, (str, int, float, Decimal)):
+        return None
+    if isinstance(amount, (int, float)):
+        amount = f'{amount:.2f}'
+    amount = str(amount).strip()
+    if not amount:
+        return None
+    try:
+        value = Decimal(amount)
+    except InvalidOperation:
+        try:
+            value = parse_amount(amount)
+        except InvalidOperation:
+            return None
+    if not value.is_finite():
+        return None
+    code = currency.strip().upper() if isinstance(currency, str) and currency.strip() else None
+    symbol = SYMBOL_FOR_CODE.get(code)
+    if symbol:
+        text = f'{symbol}{amount}'
+    elif code:
+        text = f'{code} {amount}'
+    else:
+        text = amount
+    return Price(value, code, text)
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+
+import metrics
+
+# statuses that mean the host itself is in trouble, as opposed to a bad url
+HOST_FAILURE_STATUSES = {500, 502, 503, 504}
+NETWORK_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError,
+                  requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, host, retry_in):
+        super().__init__(f"{host} is failing, requests are paused for {retry_in:.1f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=1, timer=time.monotonic):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.timer = timer
+        self.updated = timer()
+        self.blocked_until = 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        # tokens may go negative: every caller books its slot up front and
+        # just sleeps until then, so waiters are served in arrival order
+        now = self.timer()
+        self.refill(now)
+        self.tokens -= 1
+        delay = 0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(delay, self.blocked_until - now)
+
+    def set_rate(self, rate):
+        self.refill(self.timer())
+        self.rate = rate
+
+    def pause(self, seconds):
+        # nothing goes out for `seconds`, and no saved-up burst right after
+        now = self.timer()
+        self.refill(now)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = min(self.tokens, 0)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class CircuitBreaker:
+    # closed -> open after failure_threshold host failures in a row; open
+    # fails fast for reset_timeout, then lets one trial request through
+    # (half-open) which either closes it again or reopens it
+    def __init__(self, failure_threshold=5, reset_timeout=30, timer=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timer = timer
+        self.failures = 0
+        self.opened_at = None
+        self.trial_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self.trial_at is not None else 'open'
+
+    def retry_in(self):
+        # 0 when a request may go out now
+        if self.opened_at is None:
+            return 0
+        now = self.timer()
+        if self.trial_at is not None and now - self.trial_at < self.reset_timeout:
+            return self.trial_at + self.reset_timeout - now
+        wait = self.opened_at + self.reset_timeout - now
+        if wait > 0:
+            return wait
+        self.trial_at = now
+        return 0
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = self.timer()
+            self.trial_at = None
+
+
+def retry_after_seconds(value):
+    # Retry-After is either seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def error_response(err):
+    # (status, headers) of an aiohttp or requests HTTP error, else (None, None)
+    if isinstance(err, aiohttp.ClientResponseError):
+        return err.status, err.headers or {}
+    response = getattr(err, 'response', None)
+    if isinstance(err, requests.exceptions.HTTPError) and response is not None:
+        return response.status_code, response.headers
+    return None, None
+
+
+class HostRateLimiter:
+    # Token bucket plus circuit breaker per host. The rate adapts AIMD-style:
+    # a 429 halves the host's rate (down to min_rate) and pauses it for
+    # Retry-After, each success gives back a tenth of the configured rate.
+    def __init__(self, rate=5, burst=5, min_rate=None, failure_threshold=5, reset_timeout=30, timer=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate if min_rate is not None else rate / 20
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timer = timer
+        self.buckets = {}
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, host):
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = TokenBucket(self.rate, self.burst, self.timer)
+        return bucket
+
+    def breaker(self, host):
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout, self.timer)
+        return breaker
+
+    def reserve(self, url):
+        # seconds to wait before sending, or CircuitOpenError for a dead host
+        host = urlsplit(url).hostname
+        with self._lock:
+            retry_in = self.breaker(host).retry_in()
+            if retry_in > 0:
+                metrics.inc('ratelimit_rejected_total')
+                raise CircuitOpenError(host, retry_in)
+            return self.bucket(host).reserve()
+
+    async def acquire(self, url):
+        delay = self.reserve(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self, url):
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    def record_response(self, url, status, headers=None):
+        host = urlsplit(url).hostname
+        with self._lock:
+            bucket = self.bucket(host)
+            if status == 429:
+                metrics.inc('ratelimit_throttled_total')
+                bucket.set_rate(max(self.min_rate, bucket.rate / 2))
+                bucket.pause(retry_after_seconds((headers or {}).get('Retry-After')) or 1 / bucket.rate)
+            elif status in HOST_FAILURE_STATUSES:
+                self.record_host_failure(host)
+            else:
+                self.breaker(host).record_success()
+                if bucket.rate < self.rate:
+                    bucket.set_rate(min(self.rate, bucket.rate + self.rate / 10))
+
+    def record_error(self, url, err):
+        status, headers = error_response(err)
+        if status is not None:
+            self.record_response(url, status, headers)
+        elif isinstance(err, NETWORK_ERRORS):
+            with self._lock:
+                self.record_host_failure(urlsplit(url).hostname)
+
+    def record_host_failure(self, host):
+        breaker = self.breaker(host)
+        was_open = breaker.opened_at is not None
+        breaker.record_failure()
+        if breaker.opened_at is not None and not was_open:
+            metrics.inc('ratelimit_circuit_opened_total')
+
+
+_default_limiter = None
+
+
+def get_host_limiter():
+    # shared by the bot's fetches (sync and async) and ProductParser
+    global _default_limiter
+    if _default_limiter is None:
+        rate = float(os.getenv('HOST_RATE', 20))
+        _default_limiter = HostRateLimiter(rate=rate, burst=max(1, int(rate)))
+    return _default_limiter
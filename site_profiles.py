@@ -0,0 +1,92 @@
+import json
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import soupsieve
+
+from price import make_price, parse_price
+
+# domain -> profile spec, compiled into a SiteProfile on first lookup.
+# A domain also covers its subdomains (shop-jp.doverstreetmarket.com).
+#   name / price      CSS selector, text of the first match
+#   json              CSS selector of a <script> holding JSON, with
+#   name_path / price_path / currency_path   dotted paths inside it ('product.offers.0.price')
+#   extract           function(soup) -> (name, Price or None)
+#   shopify           ask /products/<handle>.js before downloading the page
+# Empty until a profile is checked against the live shop: the Shopify .js
+# answer has no currency without the cart_currency cookie, and then the page
+# is fetched anyway, so 'shopify' on an unchecked shop costs an extra request.
+PROFILES = {}
+
+
+def split_path(path):
+    return tuple(int(key) if key.isdigit() else key for key in path.split('.')) if path else None
+
+
+def json_path(data, path):
+    for key in path or ():
+        try:
+            data = data[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return data if path else None
+
+
+class SiteProfile:
+    def __init__(self, domain, name=None, price=None, json=None, name_path=None, price_path=None,
+                 currency_path=None, extract=None, shopify=False):
+        self.domain = domain
+        self.name_selector = soupsieve.compile(name) if name else None
+        self.price_selector = soupsieve.compile(price) if price else None
+        self.json_selector = soupsieve.compile(json) if json else None
+        self.name_path = split_path(name_path)
+        self.price_path = split_path(price_path)
+        self.currency_path = split_path(currency_path)
+        self.custom_extract = extract
+        self.use_shopify_json = shopify
+
+    @property
+    def has_lookups(self):
+        return bool(self.name_selector or self.price_selector or self.json_selector or self.custom_extract)
+
+    def extract(self, soup):
+        # (name, price) from the targeted lookups, either may be None and is
+        # then left to the generic heuristics
+        if self.custom_extract is not None:
+            return self.custom_extract(soup)
+        name = price = None
+        if self.json_selector is not None:
+            script = self.json_selector.select_one(soup)
+            try:
+                data = json.loads(script.string or '') if script is not None else None
+            except ValueError:
+                data = None
+            name = json_path(data, self.name_path)
+            price = make_price(json_path(data, self.price_path), json_path(data, self.currency_path))
+        if not name and self.name_selector is not None:
+            tag = self.name_selector.select_one(soup)
+            name = tag.get_text(strip=True) if tag is not None else None
+        if price is None and self.price_selector is not None:
+            tag = self.price_selector.select_one(soup)
+            price = parse_price(tag.get_text(strip=True)) if tag is not None else None
+        return name or None, price
+
+
+def register_profile(domain, **spec):
+    PROFILES[domain.lower()] = spec
+    profile_for_host.cache_clear()
+
+
+def get_profile(url):
+    return profile_for_host((urlsplit(url).hostname or '').lower())
+
+
+@lru_cache(maxsize=4096)
+def profile_for_host(host):
+    parts = host.split('.')
+    for i in range(len(parts) - 1):
+        domain = '.'.join(parts[i:])
+        spec = PROFILES.get(domain)
+        if spec is not None:
+            return SiteProfile(domain, **spec)
+    return None
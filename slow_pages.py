@@ -0,0 +1,133 @@
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+def resolve_profiler(name):
+    # pyinstrument is optional, like lxml in html_backends
+    if name == 'pyinstrument':
+        try:
+            import pyinstrument  # noqa: F401
+        except ImportError:
+            logging.warning("pyinstrument is not installed, falling back to cProfile.")
+            return 'cprofile'
+    elif name not in PROFILERS:
+        raise ValueError(f"Unknown profiler {name!r}, expected one of {PROFILERS}.")
+    return name
+
+
+class SlowPageSampler:
+    # Opt-in ring buffer of slow pages: when a fetch or parse goes over the
+    # threshold (seconds) the raw html, a profile of parsing it again and a
+    # .json with timings are written to `directory`; only the newest
+    # max_samples are kept. Capturing runs on a background thread and is
+    # skipped while max_pending captures are queued, so a burst of slow
+    # pages never holds up the parser.
+    def __init__(self, directory, threshold=2.0, fetch_threshold=None, max_samples=50, profiler='cprofile', max_pending=2):
+        self.directory = directory
+        self.threshold = threshold
+        self.fetch_threshold = fetch_threshold if fetch_threshold is not None else threshold
+        self.max_samples = max_samples
+        self.profiler = resolve_profiler(profiler)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.captured = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-pages')
+        os.makedirs(directory, exist_ok=True)
+
+    def check(self, url, html, fetch_seconds, parse_seconds, parse, backend=None):
+        # parse(url, html, backend) is re-run under the profiler
+        slow_fetch = fetch_seconds is not None and fetch_seconds >= self.fetch_threshold
+        slow_parse = parse_seconds is not None and parse_seconds >= self.threshold
+        if not (slow_fetch or slow_parse) or html is None:
+            return None
+        with self._lock:
+            if self.pending >= self.max_pending:
+                return None
+            self.pending += 1
+        sample = {
+            'url': url,
+            'stage': '+'.join(stage for stage, slow in (('fetch', slow_fetch), ('parse', slow_parse)) if slow),
+            'fetch_seconds': fetch_seconds,
+            'parse_seconds': parse_seconds,
+            'backend': backend,
+            'captured_at': time.time(),
+        }
+        return self._executor.submit(self.capture, sample, html, parse)
+
+    def capture(self, sample, html, parse):
+        try:
+            base = os.path.join(self.directory, f'{time.time_ns()}-{urlsplit(sample["url"]).hostname}')
+            with open(base + '.page.html', 'w', encoding='utf-8') as f:
+                f.write(html)
+            started = time.perf_counter()
+            result, sample['profile'] = self.profile(parse, (sample['url'], html, sample['backend']), base)
+            sample['replay_seconds'] = time.perf_counter() - started
+            sample['name'], sample['price'] = result['name'], result['price']
+            with open(base + '.json', 'w', encoding='utf-8') as f:
+                json.dump(sample, f, ensure_ascii=False, indent=2)
+            self.captured += 1
+            self.trim()
+            logging.warning(f"Slow {sample['stage']} on {sample['url']} saved to {base}.json")
+            return base
+        except Exception as err:
+            logging.error(f"Cannot save slow page sample for {sample['url']}: {err}")
+            return None
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def profile(self, parse, args, base):
+        if self.profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+            try:
+                result = parse(*args)
+            finally:
+                profiler.stop()
+            path = base + '.pyinstrument.html'
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler = cProfile.Profile()
+            result = profiler.runcall(parse, *args)
+            path = base + '.prof'
+            profiler.dump_stats(path)
+        return result, os.path.basename(path)
+
+    def trim(self):
+        samples = sorted(name[:-len('.json')] for name in os.listdir(self.directory) if name.endswith('.json'))
+        for name in samples[:max(0, len(samples) - self.max_samples)]:
+            for suffix in ('.json', '.page.html', '.prof', '.pyinstrument.html'):
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def load_samples(directory):
+    # samples in the benchmarks/bench_corpus.py corpus format, oldest first
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json'):
+            continue
+        base = os.path.join(directory, name[:-len('.json')])
+        with open(base + '.json', encoding='utf-8') as f:
+            sample = json.load(f)
+        with open(base + '.page.html', encoding='utf-8') as f:
+            html = f.read()
+        corpus.append({'file': os.path.basename(base) + '.page.html', 'url': sample['url'],
+                       'name': sample['name'], 'price': sample['price'], 'html': html})
+    return corpus
@@ -0,0 +1,115 @@
+import codecs
+from html.parser import HTMLParser
+
+from price import has_price, parse_price
+from structured import StructuredCollector
+
+CHUNK_SIZE = 16384
+# a value from a higher ranked source replaces a lower ranked one
+SOURCE_RANK = {'dom': 0, 'meta': 1, 'json-ld': 2}
+
+
+class StreamingExtractor(HTMLParser):
+    # Incremental scan for name and price while the page is still downloading.
+    # Full parsing prefers json-ld, then meta, then the DOM picks, and json-ld
+    # may come anywhere in <body>, so by default only json-ld values end the
+    # download. Meta values and the first <h1> / text-only price <span> in
+    # <body> are kept as provisional answers that a later, better source
+    # replaces; with stop_on_dom=True they end the download too (faster, may
+    # differ from full parsing). If the page ends before that, the caller
+    # parses the collected text as usual.
+    def __init__(self, encoding='utf-8', stop_on_dom=False):
+        super().__init__(convert_charrefs=True)
+        self.stop_on_dom = stop_on_dom
+        self.decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+        self.chunks = []
+        self.bytes_read = 0
+        self.in_body = False
+        self.structured = StructuredCollector()
+        self.name = None
+        self.name_source = None
+        self.price = None
+        self.price_source = None
+        self.script_text = None
+        self.h1_text = None
+        self.h1_depth = 0
+        self.h1_seen = False
+        self.spans = []
+
+    @property
+    def done(self):
+        if self.name is None or self.price is None:
+            return False
+        return self.stop_on_dom or self.name_source == self.price_source == 'json-ld'
+
+    def feed_bytes(self, data):
+        self.bytes_read += len(data)
+        text = self.decoder.decode(data)
+        self.chunks.append(text)
+        self.feed(text)
+        return self.done
+
+    def text(self):
+        self.chunks.append(self.decoder.decode(b'', final=True))
+        return ''.join(self.chunks)
+
+    def found(self, field, value, source):
+        current = getattr(self, f'{field}_source')
+        if value and (current is None or SOURCE_RANK[source] > SOURCE_RANK[current]):
+            setattr(self, field, value)
+            setattr(self, f'{field}_source', source)
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self.spans:
+            # a span with child tags has no single .string, DOM search skips it
+            self.spans[-1] = None
+        if tag == 'meta':
+            self.structured.add_meta(attrs)
+        elif tag == 'script' and attrs.get('type') == 'application/ld+json':
+            self.script_text = []
+        elif tag == 'body':
+            self.head_finished()
+        elif tag == 'h1' and not self.h1_seen:
+            self.h1_seen = True
+            self.h1_text = []
+        elif tag == 'span':
+            self.spans.append([])
+        if self.h1_text is not None and tag not in ('meta', 'br', 'img', 'input'):
+            self.h1_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag == 'script' and self.script_text is not None:
+            self.structured.add_json_ld(''.join(self.script_text))
+            self.script_text = None
+            self.found_structured(self.structured.found)
+        elif tag == 'head':
+            self.head_finished()
+        elif tag == 'span' and self.spans:
+            span_text = self.spans.pop()
+            if span_text is not None and self.in_body and has_price(''.join(span_text)):
+                self.found('price', parse_price(''.join(span_text).strip()), 'dom')
+        if self.h1_text is not None:
+            self.h1_depth -= 1
+            if tag == 'h1' or self.h1_depth <= 0:
+                name = ''.join(piece.strip() for piece in self.h1_text)
+                self.h1_text = None
+                if self.in_body:
+                    self.found('name', name, 'dom')
+
+    def handle_data(self, data):
+        if self.script_text is not None:
+            self.script_text.append(data)
+        if self.h1_text is not None:
+            self.h1_text.append(data)
+        if self.spans and self.spans[-1] is not None:
+            self.spans[-1].append(data)
+
+    def found_structured(self, values):
+        for field, (value, source) in values.items():
+            self.found(field, value, source)
+
+    def head_finished(self):
+        if not self.in_body:
+            self.in_body = True
+            self.found_structured(self.structured.result())
@@ -0,0 +1,126 @@
+import json
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+from price import make_price
+
+
+NAME_META = ('og:title', 'twitter:title')
+PRICE_META = ('product:price:amount', 'og:price:amount', 'price')
+CURRENCY_META = ('product:price:currency', 'og:price:currency', 'priceCurrency')
+
+SHOPIFY_PRODUCT_PATH = re.compile(r'^(.*/products/[^/]+?)(?:\.js|\.json)?/?$')
+
+
+def iter_json_ld_nodes(data):
+    if isinstance(data, list):
+        for item in data:
+            yield from iter_json_ld_nodes(item)
+    elif isinstance(data, dict):
+        yield data
+        if '@graph' in data:
+            yield from iter_json_ld_nodes(data['@graph'])
+
+
+def json_ld_text(value):
+    # schema.org text is a string, {"@value": ...} or a list of those
+    if isinstance(value, list):
+        return next((text for text in map(json_ld_text, value) if text), None)
+    if isinstance(value, dict):
+        value = value.get('@value')
+    return value if isinstance(value, str) else None
+
+
+def is_product_node(node):
+    types = node.get('@type')
+    return 'Product' in (types if isinstance(types, list) else [types])
+
+
+def offer_price(offers):
+    for offer in offers if isinstance(offers, list) else [offers]:
+        if not isinstance(offer, dict):
+            continue
+        amount = offer.get('price', offer.get('lowPrice'))
+        if amount is None and isinstance(offer.get('priceSpecification'), dict):
+            amount = offer['priceSpecification'].get('price')
+        if amount is not None:
+            return make_price(amount, json_ld_text(offer.get('priceCurrency')))
+    return None
+
+
+def product_from_json_ld(text):
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None, None
+    for node in iter_json_ld_nodes(data):
+        if is_product_node(node):
+            return json_ld_text(node.get('name')), offer_price(node.get('offers'))
+    return None, None
+
+
+class StructuredCollector:
+    # gathers json-ld and meta values from tags as a page is walked; result()
+    # gives {'name': (value, source), 'price': (value, source)}, json-ld first
+    def __init__(self):
+        self.found = {}
+        self.meta = {}
+
+    def add_tag(self, tag):
+        if tag.name == 'script':
+            if tag.get('type') == 'application/ld+json':
+                self.add_json_ld(tag.get_text())
+        elif tag.name == 'meta':
+            self.add_meta(tag.attrs)
+
+    def add_json_ld(self, text):
+        if 'name' in self.found and 'price' in self.found:
+            return
+        name, price = product_from_json_ld(text)
+        if name and 'name' not in self.found:
+            self.found['name'] = (name.strip(), 'json-ld')
+        if price and 'price' not in self.found:
+            self.found['price'] = (price, 'json-ld')
+
+    def add_meta(self, attrs):
+        key = attrs.get('property') or attrs.get('name') or attrs.get('itemprop')
+        if key and key not in self.meta and attrs.get('content'):
+            self.meta[key] = attrs['content']
+
+    def result(self):
+        found = dict(self.found)
+        if 'name' not in found:
+            name = next((self.meta[key] for key in NAME_META if key in self.meta), None)
+            if name:
+                found['name'] = (name.strip(), 'meta')
+        if 'price' not in found:
+            amount = next((self.meta[key] for key in PRICE_META if key in self.meta), None)
+            currency = next((self.meta[key] for key in CURRENCY_META if key in self.meta), None)
+            price = make_price(amount, currency)
+            if price:
+                found['price'] = (price, 'meta')
+        return found
+
+
+def extract_structured(soup):
+    collector = StructuredCollector()
+    for tag in soup.find_all(['script', 'meta']):
+        collector.add_tag(tag)
+    return collector.result()
+
+
+def shopify_product_url(url):
+    parts = urlsplit(url)
+    match = SHOPIFY_PRODUCT_PATH.match(parts.path)
+    if not match:
+        return None
+    return urlunsplit((parts.scheme, parts.netloc, match.group(1) + '.js', '', ''))
+
+
+def product_from_shopify(data, currency=None):
+    # /products/<handle>.js gives the price in cents; the currency only comes
+    # with the cart_currency cookie
+    name = data.get('title') if isinstance(data, dict) else None
+    cents = data.get('price') if isinstance(data, dict) else None
+    price = make_price(cents / 100, currency) if isinstance(cents, (int, float)) and not isinstance(cents, bool) else None
+    return name, price
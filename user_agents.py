@@ -0,0 +1,78 @@
+import logging
+import os
+import random
+import threading
+from urllib.parse import urlsplit
+
+# used when neither a UA file nor the fake_useragent dataset can be loaded
+FALLBACK_USER_AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:125.0) Gecko/20100101 Firefox/125.0',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+)
+
+
+def load_user_agents(path=None):
+    # one agent per line, blank lines and '#' comments skipped
+    if path:
+        with open(path, encoding='utf-8') as f:
+            agents = [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+        if agents:
+            return agents
+        logging.warning(f"No user agents in {path}, using the built-in list.")
+        return list(FALLBACK_USER_AGENTS)
+    try:
+        from fake_useragent import UserAgent
+        agents = [browser['useragent'] for browser in UserAgent().data_browsers]
+    except Exception as err:
+        logging.warning(f"Cannot load fake_useragent data: {err}")
+        agents = []
+    return agents or list(FALLBACK_USER_AGENTS)
+
+
+class UserAgentPool:
+    # The agent list is read once, on first use. With sticky=True each host
+    # keeps the agent it got first, so a shop sees one consistent browser.
+    def __init__(self, agents=None, path=None, sticky=True, rng=None):
+        self._agents = list(agents) if agents else None
+        self.path = path
+        self.sticky = sticky
+        self.by_host = {}
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+
+    @property
+    def agents(self):
+        if self._agents is None:
+            with self.lock:
+                if self._agents is None:
+                    self._agents = load_user_agents(self.path)
+        return self._agents
+
+    def agent_for(self, url):
+        if not self.sticky:
+            return self.rng.choice(self.agents)
+        host = urlsplit(url).hostname or ''
+        agent = self.by_host.get(host)
+        if agent is None:
+            agent = self.by_host.setdefault(host, self.rng.choice(self.agents))
+        return agent
+
+    def rotate(self, url):
+        # forget the sticky agent of this host, e.g. after it started blocking us
+        self.by_host.pop(urlsplit(url).hostname or '', None)
+
+    def headers_for(self, url):
+        return {'User-Agent': self.agent_for(url)}
+
+
+_default_pool = None
+
+
+def get_user_agents():
+    global _default_pool
+    if _default_pool is None:
+        # USER_AGENT_FILE points at an offline list, otherwise fake_useragent's dataset
+        _default_pool = UserAgentPool(path=os.getenv('USER_AGENT_FILE'))
+    return _default_pool